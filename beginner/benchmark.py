@@ -0,0 +1,314 @@
+"""Benchmarks for the sandbox hot paths.
+
+Run with `python -m beginner.benchmark`. Results are written to a JSON baseline, pass an earlier baseline with
+--compare to see how each benchmark has changed since it was taken. Everything is timed on this machine so only
+compare baselines taken on the same host.
+
+The micro benchmarks (AST scan, builtins, wrapped module access) run in this process. Runs are only ever timed end
+to end through the runner backends since Executer.run applies resource limits to the process it runs in."""
+from beginner.runner_pool import OutputLimits, RunnerPool, RunnerZygote
+from beginner.runner_queue import RunnerQueue
+from beginner.runner_rewrite.builtins import RunnerBuiltins
+from beginner.runner_rewrite.buffer import RunnerInputBuffer, RunnerOutputBuffer
+from beginner.runner_rewrite.module_wrapper import wrap_module
+from beginner.runner_rewrite.policy import load_policy
+from beginner.runner_rewrite.scanner import Scanner, scan
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import argparse
+import ast
+import asyncio
+import json
+import math
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import time
+
+
+SAMPLE_CODE = '''import math
+import random
+
+def primes(limit):
+    found = []
+    for n in range(2, limit):
+        if all(n % p for p in found if p <= math.isqrt(n)):
+            found.append(n)
+    return found
+
+class Point:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def __repr__(self):
+        return f"Point({self.x}, {self.y})"
+
+points = [Point(random.random(), random.random()) for _ in range(10)]
+print(primes(100), points[0].__class__.__name__)
+'''
+
+RUN_CASES = {
+    "eval": ("eval", "sum(range(1000))", ""),
+    "exec": ("exec", "for i in range(10):\n    print(i * i)", ""),
+    "exec_input": ("exec", "name = input('Name? ')\nprint(f'Hello {name}')", "Zech"),
+    "exec_math": ("exec", "import math\nprint(sum(math.sqrt(i) for i in range(10000)))", ""),
+}
+ENGINES = ("legacy", "rewrite")
+
+
+def import_legacy_runner():
+    """The legacy runner empties os.environ when it's imported, put it back so the subprocesses started by the
+    benchmarks get a normal environment."""
+    environ = os.environ
+    import beginner.runner
+
+    os.environ = environ
+    return beginner.runner
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarizes timings given in seconds as microseconds."""
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_us": statistics.fmean(samples) * 1_000_000,
+        "p50_us": samples[len(samples) // 2] * 1_000_000,
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1_000_000,
+        "min_us": samples[0] * 1_000_000,
+    }
+
+
+def time_calls(func: Callable[[], Any], rounds: int, number: int = 1) -> Dict[str, float]:
+    """Times rounds batches of number calls, reporting the time per call."""
+    func()  # Warm up
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return summarize(samples)
+
+
+def bench_scanning(rounds: int) -> Dict[str, Dict[str, float]]:
+    tree = ast.parse(SAMPLE_CODE)
+    return {
+        "ast_parse": time_calls(lambda: ast.parse(SAMPLE_CODE), rounds, 10),
+        "scan_tree": time_calls(lambda: Scanner.scan_tree(tree), rounds, 10),
+        "scan_cached": time_calls(lambda: scan(SAMPLE_CODE), rounds, 10),
+    }
+
+
+def bench_builtins(rounds: int) -> Dict[str, Dict[str, float]]:
+    runner = import_legacy_runner()
+    executer = runner.create_executer(runner.load_allowed_modules())
+
+    def rewrite_builtins(restricted: bool):
+        return (
+            RunnerBuiltins.context(
+                load_policy(restricted=restricted),
+                RunnerInputBuffer(),
+                RunnerOutputBuffer(),
+            )
+            .build()
+            .get_builtins()
+        )
+
+    return {
+        "builtins_legacy_restricted": time_calls(
+            lambda: executer.generate_builtins(True), rounds, 10
+        ),
+        "builtins_legacy_unrestricted": time_calls(
+            lambda: executer.generate_builtins(False), rounds, 10
+        ),
+        "builtins_rewrite_restricted": time_calls(
+            lambda: rewrite_builtins(True), rounds, 10
+        ),
+        "builtins_rewrite_unrestricted": time_calls(
+            lambda: rewrite_builtins(False), rounds, 10
+        ),
+    }
+
+
+def bench_module_access(rounds: int) -> Dict[str, Dict[str, float]]:
+    runner = import_legacy_runner()
+    executer = runner.create_executer(runner.load_allowed_modules())
+    modules = {
+        "native": math,
+        "legacy": runner.Module(math, executer),
+        "rewrite": wrap_module(math, load_policy()),
+    }
+
+    def access(module):
+        sqrt = None
+        for _ in range(1000):
+            sqrt = module.sqrt
+        return sqrt
+
+    return {
+        f"module_access_{name}": time_calls(lambda module=module: access(module), rounds)
+        for name, module in modules.items()
+    }
+
+
+async def time_async_calls(
+    func: Callable[[], Awaitable], rounds: int
+) -> Dict[str, float]:
+    await func()  # Warm up
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def create_backend(name: str) -> RunnerPool | RunnerZygote:
+    if name == "zygote":
+        return RunnerZygote(output_limits=OutputLimits())
+    if name == "cold":
+        return RunnerPool(size=0, output_limits=OutputLimits())
+    return RunnerPool(size=2, output_limits=OutputLimits())
+
+
+async def bench_cold_start(rounds: int) -> Dict[str, Dict[str, float]]:
+    """Time from handing a trivial job to a backend to having its result, with no warm process to take it."""
+    backend = create_backend("cold")
+    try:
+        return {
+            "cold_start_pool": await time_async_calls(
+                lambda: backend.run("eval", "1"), rounds
+            )
+        }
+    finally:
+        await backend.close()
+
+
+async def bench_runs(
+    backends: List[str], rounds: int
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for backend_name in backends:
+        backend = create_backend(backend_name)
+        backend.fill()
+        try:
+            for engine in ENGINES:
+                for case, (mode, code, user_input) in RUN_CASES.items():
+                    results[f"run_{backend_name}_{engine}_{case}"] = await time_async_calls(
+                        lambda: backend.run(mode, code, user_input, True, engine),
+                        rounds,
+                    )
+        finally:
+            await backend.close()
+    return results
+
+
+async def bench_throughput(
+    backends: List[str], concurrency_levels: List[int], jobs: int
+) -> Dict[str, Dict[str, float]]:
+    """Pushes jobs through a runner queue from a handful of users at each concurrency level."""
+    results = {}
+    mode, code, user_input = RUN_CASES["exec"]
+    for backend_name in backends:
+        for engine in ENGINES:
+            for concurrency in concurrency_levels:
+                backend = create_backend(backend_name)
+                backend.fill()
+                queue = RunnerQueue(backend, concurrency=concurrency, max_depth=jobs)
+                latencies = []
+
+                async def run_job(user_id: int):
+                    start = time.perf_counter()
+                    await queue.run(
+                        user_id, None, mode, code, user_input, True, engine
+                    )
+                    latencies.append(time.perf_counter() - start)
+
+                try:
+                    await backend.run(mode, code, user_input, True, engine)  # Warm up
+                    start = time.perf_counter()
+                    await asyncio.gather(*(run_job(job % 4) for job in range(jobs)))
+                    elapsed = time.perf_counter() - start
+                finally:
+                    await backend.close()
+
+                summary = summarize(latencies)
+                summary["jobs_per_second"] = jobs / elapsed
+                results[
+                    f"throughput_{backend_name}_{engine}_concurrency_{concurrency}"
+                ] = summary
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline_path: pathlib.Path):
+    baseline = json.loads(baseline_path.read_text())["results"]
+    print(f"\nCompared to {baseline_path}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        before, after = baseline[name]["p50_us"], result["p50_us"]
+        change = (after - before) / before * 100 if before else 0
+        flag = "  <-- slower" if change > 10 else ""
+        print(f"{name:<60} {before:>12,.1f}us -> {after:>12,.1f}us {change:+7.1f}%{flag}")
+
+
+def print_results(results: Dict[str, Dict[str, float]]):
+    for name, result in results.items():
+        line = f"{name:<60} p50 {result['p50_us']:>12,.1f}us  p95 {result['p95_us']:>12,.1f}us"
+        if "jobs_per_second" in result:
+            line += f"  {result['jobs_per_second']:>8,.1f} jobs/s"
+        print(line)
+
+
+async def run_benchmarks(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    results = {}
+    results.update(bench_scanning(args.rounds))
+    results.update(bench_builtins(args.rounds))
+    results.update(bench_module_access(args.rounds))
+    if not args.skip_runs:
+        results.update(await bench_cold_start(max(1, args.rounds // 4)))
+        results.update(await bench_runs(args.backends, args.rounds))
+        results.update(
+            await bench_throughput(args.backends, args.concurrency, args.jobs)
+        )
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m beginner.benchmark", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("--output", type=pathlib.Path, default=pathlib.Path("runner-benchmark.json"))
+    parser.add_argument("--compare", type=pathlib.Path, help="Baseline to compare the results against")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--jobs", type=int, default=32, help="Jobs run at each concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--backends", nargs="+", choices=("pool", "zygote"), default=["pool", "zygote"])
+    parser.add_argument("--skip-runs", action="store_true", help="Only run the in-process micro benchmarks")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmarks(args))
+    print_results(results)
+    if args.compare:
+        compare(results, args.compare)
+
+    args.output.write_text(
+        json.dumps(
+            {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,456 @@
-from queue import LifoQueue
-from typing import Optional, Tuple
+from beginner.bytecode_cache import compile_source
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import time
+
+
+ADD = 0  # Add arg to the current cell
+MOVE = 1  # Move the pointer by arg cells
+PRINT = 2
+READ = 3
+JUMP_FORWARD = 4  # Jump past the matching JUMP_BACK (arg) if the cell is zero
+JUMP_BACK = 5  # Jump back past the matching JUMP_FORWARD (arg) if the cell isn't zero
+CLEAR = 6  # [-] & friends, arg is the change to the cell each iteration (1 or 255)
+SCAN = 7  # [>] & friends, arg is (step, cost of each iteration)
+MULTIPLY = 8  # [->+>++<<] & friends, arg is (direction, ((offset, factor), ...), cost of each iteration)
+
+INSTRUCTIONS = frozenset("+-<>.,[]")
+MAX_STEPS = 1_000_000
+MAX_TAPE = 1_048_576  # Registers the transpiled programs can use
+CHECK_INTERVAL = 100_000  # Steps between wall clock & budget checks
+TIMED_OUT = "Beginnerpy.ScriptTimedOut: Script took too long to complete"  # Depends on load so it isn't cached
+
+
+class Instruction(NamedTuple):
+    op: int
+    arg: object
+    cost: int  # How many source instructions this stands in for
+    position: int  # Index in the source of the first character it was compiled from
+
+
+class BrainfuckCompileError(Exception):
+    pass
+
+
+def compile_brainfuck(code: str) -> List[Instruction]:
+    """Compiles the source into a compact list of instructions.
+
+    Anything that isn't an instruction is dropped, runs of +- and <> are folded into single adds & moves, clear, scan
+    & multiply loops are replaced with a single instruction, and every bracket gets the index of its match."""
+    tokens = [
+        (char, position) for position, char in enumerate(code) if char in INSTRUCTIONS
+    ]
+    matches = _match_brackets(tokens)
+    program: List[Instruction] = []
+    open_loops: List[int] = []
+    index = 0
+    while index < len(tokens):
+        char, position = tokens[index]
+        if char in "+-<>":
+            end = index
+            while end < len(tokens) and tokens[end][0] in (
+                "+-" if char in "+-" else "<>"
+            ):
+                end += 1
+
+            run = "".join(token for token, _ in tokens[index:end])
+            if char in "+-":
+                program.append(
+                    Instruction(
+                        ADD, (run.count("+") - run.count("-")) % 256, len(run), position
+                    )
+                )
+            else:
+                program.append(
+                    Instruction(
+                        MOVE, run.count(">") - run.count("<"), len(run), position
+                    )
+                )
+            index = end
+
+        elif char == "[":
+            body = "".join(token for token, _ in tokens[index + 1 : matches[index]])
+            idiom = _compile_idiom(body, position)
+            if idiom:
+                program.append(idiom)
+                index = matches[index] + 1
+                continue
+
+            open_loops.append(len(program))
+            program.append(Instruction(JUMP_FORWARD, None, 1, position))
+            index += 1
+
+        elif char == "]":
+            start = open_loops.pop()
+            program[start] = program[start]._replace(arg=len(program))
+            program.append(Instruction(JUMP_BACK, start, 1, position))
+            index += 1
+
+        else:
+            program.append(
+                Instruction(PRINT if char == "." else READ, None, 1, position)
+            )
+            index += 1
+
+    return program
+
+
+def _match_brackets(tokens: List[Tuple[str, int]]) -> Dict[int, int]:
+    matches = {}
+    stack = []
+    for index, (char, position) in enumerate(tokens):
+        if char == "[":
+            stack.append(index)
+        elif char == "]":
+            if not stack:
+                raise BrainfuckCompileError(
+                    f"No matching jump forward for the back jump at instruction {position}"
+                )
+            matches[stack.pop()] = index
+
+    if stack:
+        raise BrainfuckCompileError(
+            f"No back jump found after the instruction {tokens[stack[-1]][1]}"
+        )
+
+    return matches
+
+
+def _compile_idiom(body: str, position: int) -> Optional[Instruction]:
+    """Recognizes loops whose effect can be computed in one step, the loop body must only add & move."""
+    if not body or not set(body) <= set("+-<>"):
+        return None
+
+    cost = len(body) + 1  # The body & the back jump are run for every iteration
+    if set(body) <= set("+-"):
+        if (body.count("+") - body.count("-")) % 256 in {1, 255}:
+            return Instruction(
+                CLEAR, (body.count("+") - body.count("-")) % 256, cost, position
+            )
+        return None
+
+    if set(body) <= set("<>"):
+        step = body.count(">") - body.count("<")
+        return Instruction(SCAN, (step, cost), cost, position) if step else None
+
+    offset = 0
+    changes: Dict[int, int] = {}
+    for char in body:
+        if char in "<>":
+            offset += 1 if char == ">" else -1
+        else:
+            changes[offset] = changes.get(offset, 0) + (1 if char == "+" else -1)
+
+    direction = changes.pop(0, 0) % 256
+    if offset or direction not in {1, 255}:
+        return None
+
+    factors = tuple(
+        (cell, factor % 256) for cell, factor in changes.items() if factor % 256
+    )
+    return Instruction(MULTIPLY, (direction, factors, cost), cost, position)
 
 
 class BrainfuckInterpreter:
-    def __init__(self, code: str, data_in: str = ""):
+    def __init__(self, code: str, data_in: str = "", max_runtime: float = 5):
         self._code = code
         self._exception = None
         self._in = data_in
-        self._instruction_pointer = 0
-        self._out = ""
+        self._in_position = 0
+        self._max_runtime = max_runtime
+        self._out = bytearray()
         self._register_pointer = 0
-        self._registers = [0] * 30000
-        self._stack = LifoQueue()
-        self._generation = 0
-
-    @property
-    def register(self):
-        return self._registers[self._register_pointer]
-
-    @register.setter
-    def register(self, value):
-        self._registers[self._register_pointer] = value
+        self._registers = bytearray(30000)
+        self._steps = 0
 
     def run(self) -> Tuple[str, Optional[str]]:
-        instructions = {
-            "[": self._jump_forward,
-            "]": self._jump_back,
-            ">": self._increment_register_pointer,
-            "<": self._decrement_register_pointer,
-            "+": self._increment_register,
-            "-": self._decrement_register,
-            ".": self._print,
-            ",": self._read,
-        }
-        while self._instruction_pointer < len(self._code) and not self._exception:
-            if self._generation >= 1000000:
-                self._exception = "Code took too long to run"
-                break
+        """Runs the compiled program. The step budget is counted in source instructions, so a folded run or an
+        idiom loop uses as much of it as running every instruction it replaced would have. The wall clock is
+        checked every CHECK_INTERVAL steps."""
+        try:
+            program = compile_brainfuck(self._code)
+        except BrainfuckCompileError as exc:
+            return "", str(exc)
 
-            instruction = self._code[self._instruction_pointer]
-            if instruction in instructions:
-                self._instruction_pointer = instructions[instruction]()
-            else:
-                self._instruction_pointer += 1
+        registers = self._registers
+        out = self._out
+        pointer = 0
+        steps = 0
+        counter = 0
+        length = len(program)
+        deadline = time.monotonic() + self._max_runtime
+        next_check = CHECK_INTERVAL
+        while counter < length:
+            op, arg, cost, position = program[counter]
+            steps += cost
+            if steps > next_check:
+                if steps > MAX_STEPS:
+                    self._exception = "Code took too long to run"
+                    break
+                if time.monotonic() > deadline:
+                    self._exception = TIMED_OUT
+                    break
+                next_check = min(steps + CHECK_INTERVAL, MAX_STEPS)
 
-            self._generation += 1
+            if op == ADD:
+                registers[pointer] = (registers[pointer] + arg) & 255
 
-        return self._out, self._exception
+            elif op == MOVE:
+                pointer += arg
+                if not self._valid_pointer(pointer, position):
+                    break
 
-    def _jump_forward(self) -> int:
-        if self.register == 0:
-            return self._find_next_back_jump() + 1
+            elif op == JUMP_FORWARD:
+                if not registers[pointer]:
+                    counter = arg
 
-        self._stack.put(self._instruction_pointer)
-        return self._instruction_pointer + 1
+            elif op == JUMP_BACK:
+                if registers[pointer]:
+                    counter = arg
 
-    def _jump_back(self) -> int:
-        if self._stack.empty():
-            return self._instruction_pointer + 1
+            elif op == CLEAR:
+                iterations = (
+                    registers[pointer] if arg == 255 else -registers[pointer] & 255
+                )
+                steps += iterations * cost
+                registers[pointer] = 0
 
-        return self._stack.get()
+            elif op == SCAN:
+                step, scan_cost = arg
+                while registers[pointer] and steps <= MAX_STEPS:
+                    pointer += step
+                    steps += scan_cost
+                    if not self._valid_pointer(pointer, position):
+                        break
 
-    def _increment_register_pointer(self) -> int:
-        self._register_pointer += 1
-        if self._register_pointer == len(self._registers):
-            self._registers.append(0)
+            elif op == MULTIPLY:
+                direction, factors, _ = arg
+                value = registers[pointer]
+                iterations = value if direction == 255 else -value & 255
+                steps += iterations * cost
+                if iterations:
+                    for offset, factor in factors:
+                        if not self._valid_pointer(pointer + offset, position):
+                            break
+                        registers[pointer + offset] = (
+                            registers[pointer + offset] + factor * iterations
+                        ) & 255
+                    registers[pointer] = 0
 
-        return self._instruction_pointer + 1
+            elif op == PRINT:
+                out.append(registers[pointer])
 
-    def _decrement_register_pointer(self) -> int:
-        self._register_pointer -= 1
-        return self._instruction_pointer + 1
+            elif op == READ:
+                if not self._read(pointer, position):
+                    break
 
-    def _increment_register(self) -> int:
-        self.register += 1
-        self.register %= 256
-        return self._instruction_pointer + 1
+            if self._exception:
+                break
 
-    def _decrement_register(self) -> int:
-        self.register -= 1
-        self.register %= 256
-        return self._instruction_pointer + 1
+            counter += 1
 
-    def _print(self) -> int:
-        if 0 > self.register or self.register > 255:
-            self._exception = f"Cannot decode character {self.register} at instruction {self._instruction_pointer}"
-            return -1
+        self._register_pointer = pointer
+        self._steps = steps
+        if steps > MAX_STEPS and not self._exception:
+            self._exception = "Code took too long to run"
 
-        self._out += chr(self.register)
-        return self._instruction_pointer + 1
+        return out.decode("latin-1"), self._exception
 
-    def _read(self) -> int:
-        if not self._in:
+    def _valid_pointer(self, pointer: int, position: int) -> bool:
+        if pointer < 0:
             self._exception = (
-                f"Nothing left to read at instruction {self._instruction_pointer}"
+                f"Moved left of the first register at instruction {position}"
             )
-            return -1
+            return False
+
+        if pointer >= len(self._registers):
+            self._registers.extend(bytes(pointer - len(self._registers) + 1))
 
-        char = self._in[0]
-        if char > 255:
-            self._exception = f"Cannot encode character '{char}' at instruction {self._instruction_pointer}"
-            return -1
+        return True
 
-        self._in = self._in[1:]
-        self.register = ord(char)
-        return self._instruction_pointer + 1
+    def _read(self, pointer: int, position: int) -> bool:
+        if self._in_position >= len(self._in):
+            self._exception = f"Nothing left to read at instruction {position}"
+            return False
 
-    def _find_next_back_jump(self) -> int:
-        index = self._code.find("]", self._instruction_pointer + 1)
-        if index < 0:
+        char = self._in[self._in_position]
+        if ord(char) > 255:
             self._exception = (
-                f"No back jump found after the instruction {self._instruction_pointer}"
+                f"Cannot encode character '{char}' at instruction {position}"
             )
-        return index
+            return False
+
+        self._in_position += 1
+        self._registers[pointer] = ord(char)
+        return True
+
+
+def run_brainfuck(
+    engine: str, code: str, data_in: str = "", max_runtime: float = 5
+) -> Tuple[str, Optional[str]]:
+    """Runs the code on the named engine ("transpiler" or "interpreter"), falling back to the interpreter."""
+    engines = {"transpiler": BrainfuckTranspiler, "interpreter": BrainfuckInterpreter}
+    return engines.get(engine, BrainfuckInterpreter)(
+        code, data_in, max_runtime=max_runtime
+    ).run()
+
+
+class BrainfuckTranspiler:
+    """Runs Brainfuck by translating it into a Python function over a bytearray tape and compiling that.
+
+    Loops become while blocks and the folded instructions become single statements, so it runs far faster than the
+    interpreter and gets a much larger step budget. The budget is checked at the end of loop iterations along with a
+    wall clock deadline & an output limit, which lets it run safely in a runner process."""
+
+    def __init__(
+        self,
+        code: str,
+        data_in: str = "",
+        max_steps: int = 250_000_000,
+        max_runtime: float = 5,
+        max_output: int = 1_000_000,
+    ):
+        self._code = code
+        self._in = data_in
+        self._max_steps = max_steps
+        self._max_runtime = max_runtime
+        self._max_output = max_output
+
+    def run(self) -> Tuple[str, Optional[str]]:
+        try:
+            function = self.compile(compile_brainfuck(self._code))
+        except BrainfuckCompileError as exc:
+            return "", str(exc)
+        except (RecursionError, SyntaxError):
+            # Python limits how deeply blocks can be nested, the interpreter can run anything
+            return BrainfuckInterpreter(self._code, self._in, self._max_runtime).run()
+
+        tape = bytearray(30000)
+        out = bytearray()
+        data_in = iter(self._in)
+        deadline = time.monotonic() + self._max_runtime
+
+        def read(position: int) -> int:
+            char = next(data_in, None)
+            if char is None:
+                raise BrainfuckRuntimeError(
+                    f"Nothing left to read at instruction {position}"
+                )
+            if ord(char) > 255:
+                raise BrainfuckRuntimeError(
+                    f"Cannot encode character '{char}' at instruction {position}"
+                )
+            return ord(char)
+
+        def check(steps: int) -> int:
+            """Raises if the run is over budget, otherwise returns the step count to check again at."""
+            if steps > self._max_steps:
+                raise BrainfuckRuntimeError("Code took too long to run")
+            if time.monotonic() > deadline:
+                raise BrainfuckRuntimeError(TIMED_OUT)
+            if len(out) > self._max_output:
+                raise BrainfuckRuntimeError("Code printed too much output")
+            return steps + CHECK_INTERVAL
+
+        try:
+            function(tape, out, read, check)
+        except BrainfuckRuntimeError as exc:
+            return out.decode("latin-1"), str(exc)
+
+        return out.decode("latin-1"), None
+
+    @staticmethod
+    def compile(program: List[Instruction]) -> Callable:
+        namespace = {
+            "__builtins__": {},
+            "grow": _grow,
+            "len": len,
+            "moved_left": _moved_left,
+        }
+        exec(
+            compile_source(
+                "\n".join(transpile_brainfuck(program)), "exec", "<brainfuck>"
+            ),
+            namespace,
+        )
+        return namespace["brainfuck"]
+
+
+def transpile_brainfuck(program: List[Instruction]) -> List[str]:
+    """Translates compiled instructions into the lines of a Python function. Each loop adds up the source steps its
+    body stands in for and calls check once the step count passes the last value check returned."""
+    lines = ["def brainfuck(tape, out, read, check):", "    p = s = c = 0"]
+    costs = [0]  # Static cost of the straight line code in each open block
+
+    def emit(line: str):
+        lines.append(f"{'    ' * len(costs)}{line}")
+
+    def move(offset: str, position: int, right: bool):
+        if right:
+            emit(f"if {offset} >= len(tape): grow(tape, {offset}, {position})")
+        else:
+            emit(f"if {offset} < 0: moved_left({position})")
+
+    for op, arg, cost, position in program:
+        costs[-1] += cost
+        if op == ADD:
+            emit(f"tape[p] = (tape[p] + {arg}) & 255")
+        elif op == MOVE:
+            emit(f"p += {arg}")
+            move("p", position, arg > 0)
+        elif op == PRINT:
+            emit("out.append(tape[p])")
+        elif op == READ:
+            emit(f"tape[p] = read({position})")
+        elif op == JUMP_FORWARD:
+            emit("while tape[p]:")
+            costs.append(0)
+        elif op == JUMP_BACK:
+            body_cost = costs.pop() + 1
+            lines.append(f"{'    ' * (len(costs) + 1)}s += {body_cost}")
+            lines.append(f"{'    ' * (len(costs) + 1)}if s > c: c = check(s)")
+        elif op == CLEAR:
+            iterations = "tape[p]" if arg == 255 else "(256 - tape[p]) & 255"
+            emit(f"s += {iterations} * {cost}")
+            emit("tape[p] = 0")
+        elif op == SCAN:
+            step, scan_cost = arg
+            emit("while tape[p]:")
+            costs.append(0)
+            emit(f"p += {step}")
+            move("p", position, step > 0)
+            emit(f"s += {scan_cost}")
+            emit("if s > c: c = check(s)")
+            costs.pop()
+        elif op == MULTIPLY:
+            direction, factors, _ = arg
+            emit("if tape[p]:")
+            costs.append(0)
+            emit("n = tape[p]" if direction == 255 else "n = 256 - tape[p]")
+            for offset, factor in factors:
+                move(f"p + {offset}", position, offset > 0)
+                emit(f"tape[p + {offset}] = (tape[p + {offset}] + {factor} * n) & 255")
+            emit("tape[p] = 0")
+            emit(f"s += n * {cost}")
+            costs.pop()
+
+    lines.append("    return s")
+    return lines
+
+
+def _grow(tape: bytearray, pointer: int, position: int):
+    if pointer >= MAX_TAPE:
+        raise BrainfuckRuntimeError(
+            f"Moved right of the last register at instruction {position}"
+        )
+
+    tape.extend(bytes(min(pointer + 4096, MAX_TAPE) - len(tape)))
+
+
+def _moved_left(position: int):
+    raise BrainfuckRuntimeError(
+        f"Moved left of the first register at instruction {position}"
+    )
+
+
+class BrainfuckRuntimeError(Exception):
+    pass
@@ -0,0 +1,30 @@
+"""Cache of compiled code objects for the sandbox & the disassembler.
+
+Code objects are kept in an in-process LRU keyed by the source, mode & filename. There's deliberately no cache shared
+between processes, anything the runners can write to could be used by one run to plant code for another. The zygote
+fills its own cache before forking so the children it forks for code that's already been run start with it
+compiled."""
+from beginner.runner_rewrite.scanner import ScanResult, Scanner
+from types import CodeType
+from typing import Tuple
+import ast
+import functools
+
+
+@functools.lru_cache(maxsize=256)
+def compile_source(
+    source: str, mode: str = "exec", filename: str = "<string>"
+) -> CodeType:
+    """Compiles the source or gets it from the cache. Raises SyntaxError if it can't be compiled, only code that
+    compiles is cached."""
+    return compile(source, filename, mode, dont_inherit=True)
+
+
+@functools.lru_cache(maxsize=256)
+def scan_and_compile(
+    source: str, mode: str = "exec", filename: str = "<string>"
+) -> Tuple[ScanResult, CodeType]:
+    """Parses the source once, scanning & compiling the same tree, or gets both from the cache. Raises SyntaxError
+    if it can't be compiled."""
+    tree = ast.parse(source, filename, mode)
+    return Scanner.scan_tree(tree), compile(tree, filename, mode, dont_inherit=True)
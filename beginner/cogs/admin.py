@@ -1,6 +1,6 @@
 from beginner.cog import Cog, commands
 from beginner.colors import *
-from beginner.scheduler import schedule
+from beginner.scheduler import misfire_policy, schedule
 from beginner.tags import tag
 from datetime import timedelta
 import ast
@@ -45,6 +45,7 @@ class Admin(Cog):
             )
         )
 
+    @misfire_policy(coalesce=True)
     @tag("schedule", "remove-sus")
     async def remove_sus(self, user_id, guild_id):
         guild = self.client.get_guild(guild_id)
@@ -1,14 +1,20 @@
 from beginner.cog import Cog
 from beginner.colors import *
-from beginner.brainfuck_runner import BrainfuckInterpreter
+from beginner.config import scope_getter
+from beginner.bytecode_cache import compile_source
+from beginner.runner_cache import create_runner_cache
+from beginner.runner_rewrite.policy import load_policy
+from beginner.runner_queue import (
+    RunnerJobCancelled,
+    RunnerQueueFull,
+    create_runner_queue,
+)
 from datetime import datetime, timedelta
-from typing import Tuple
-import asyncio
+from typing import List, Optional, Tuple
 import black
 import dis
 import nextcord
 import io
-import json
 import pathlib
 import re
 
@@ -21,6 +27,15 @@ class CodeRunner(Cog):
         self._formatting_emojis = {"✏️", "📝"}
         self._delete_emojis = ("🗑️",)
         self._delete_emojis_set = set(self._delete_emojis)
+        self._runner_queue = create_runner_queue()
+        self._runner_cache = create_runner_cache()
+        self._runner_engines = scope_getter("runner")("engines", default={}) or {}
+
+    async def ready(self):
+        self._runner_queue.runner.fill()
+
+    def cog_unload(self):
+        self.client.loop.create_task(self._runner_queue.runner.close())
 
     @Cog.command()
     async def dis(self, ctx, *, content=""):
@@ -29,9 +44,9 @@ class CodeRunner(Cog):
         ).groups()[0]
         buffer = io.StringIO()
         try:
-            code = compile(source, "<discord>", "exec")
+            code = compile_source(source, "exec", "<discord>")
         except SyntaxError as excp:
-            msg, (file, line_no, column, line) = excp.args
+            msg, (file, line_no, column, line, *_) = excp.args
             spaces = " " * (column - 1)
             await ctx.send(
                 embed=nextcord.Embed(
@@ -60,18 +75,11 @@ class CodeRunner(Cog):
             return
 
         if content.strip() == "modules":
-            with (
-                pathlib.Path(__file__).parent.parent / "allowed_modules.txt"
-            ).open() as allowed_modules_file:
-                allowed_modules_list = list(
-                    line.strip()
-                    for line in allowed_modules_file.readlines()
-                    if line.strip()
-                )
-                length = len(max(allowed_modules_list, key=len)) + 2
-                allowed_modules = "".join(
-                    f"{module:{length}}" for module in allowed_modules_list
-                )
+            allowed_modules_list = self._allowed_modules()
+            length = len(max(allowed_modules_list, key=len)) + 2
+            allowed_modules = "".join(
+                f"{module:{length}}" for module in allowed_modules_list
+            )
             await ctx.send(
                 embed=nextcord.Embed(
                     description=f"Here are all of the allowed modules:\n```\n{allowed_modules}\n```",
@@ -94,6 +102,20 @@ class CodeRunner(Cog):
 
         await self._exec(ctx.message, content, ctx.author)
 
+    def _allowed_modules(self) -> List[str]:
+        """Lists the modules allowed by the engine that exec is configured to use."""
+        if self._runner_engines.get("exec", "legacy") == "rewrite":
+            return list(load_policy().modules)
+
+        with (
+            pathlib.Path(__file__).parent.parent / "allowed_modules.txt"
+        ).open() as allowed_modules_file:
+            return list(
+                line.strip()
+                for line in allowed_modules_file.readlines()
+                if line.strip()
+            )
+
     @Cog.listener()
     async def on_raw_reaction_add(self, reaction: nextcord.RawReactionActionEvent):
         if (
@@ -105,6 +127,11 @@ class CodeRunner(Cog):
             return
 
         now = datetime.utcnow()
+        self._exec_rate_limit = {
+            message_id: last_run
+            for message_id, last_run in self._exec_rate_limit.items()
+            if now - last_run < timedelta(minutes=2)
+        }
         delta = now - self._exec_rate_limit.get(reaction.message_id, now)
         channel: nextcord.TextChannel = self.client.get_channel(reaction.channel_id)
         message = await channel.fetch_message(reaction.message_id)
@@ -147,6 +174,10 @@ class CodeRunner(Cog):
         ):
             await message.delete()
 
+    @Cog.listener()
+    async def on_raw_message_delete(self, payload: nextcord.RawMessageDeleteEvent):
+        self._runner_queue.cancel(payload.message_id)
+
     async def _exec(
         self,
         message: nextcord.Message,
@@ -204,12 +235,17 @@ class CodeRunner(Cog):
                 r"^.*?```(?:python|py)?\s*(.+?)\s*```\s*(.+)?$", content, re.DOTALL
             ).groups()
 
-        out, err, duration = await self.code_runner(
-            "exec",
-            code,
-            user_input,
-            restricted=restricted,
-        )
+        try:
+            out, err, duration = await self.code_runner(
+                "exec",
+                code,
+                user_input,
+                restricted=restricted,
+                message=message,
+                member=member,
+            )
+        except RunnerJobCancelled:
+            return
 
         output = [out]
         if err:
@@ -261,10 +297,15 @@ class CodeRunner(Cog):
             r"^.*?```(?:bf|brainfuck)?\s*(.+?)\s*```\s*(.+)?$", content, re.DOTALL
         ).groups()
 
-        interpreter = BrainfuckInterpreter(
-            code, user_input + "\n" if user_input else ""
-        )
-        out, err = interpreter.run()
+        try:
+            out, err, _ = await self.code_runner(
+                "brainfuck",
+                code,
+                user_input + "\n" if user_input else "",
+                message=message,
+            )
+        except RunnerJobCancelled:
+            return
 
         output = [out]
         if err:
@@ -334,27 +375,67 @@ class CodeRunner(Cog):
             await msg.add_reaction(self._delete_emojis[0])
 
     async def code_runner(
-        self, mode: str, code: str, user_input: str = "", restricted=True
+        self,
+        mode: str,
+        code: str,
+        user_input: str = "",
+        restricted=True,
+        message: Optional[nextcord.Message] = None,
+        member: Optional[nextcord.Member] = None,
     ) -> Tuple[str, str, float]:
-        proc = await asyncio.create_subprocess_shell(
-            f"python -m beginner.runner {mode}",
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        data = json.dumps(
-            {
-                "code": code.replace(" ", " "),
-                "input": user_input,
-                "restricted": restricted,
-            }
-        ).encode()
+        code = code.replace(" ", " ")
+        cacheable = self._runner_cache.cacheable(mode, code)
+        engine = self._runner_engines.get(mode, "legacy")
+        cache_key = self._runner_cache.key(mode, code, user_input, restricted, engine)
+        if cacheable and (result := self._runner_cache.get(cache_key)):
+            self.logger.debug(f"Using cached result for:\n{code}")
+            return result
+
+        member = member or message and message.author
+        queued_message = None
+
+        async def on_queued(position: int):
+            nonlocal queued_message
+            queued_message = await message.channel.send(
+                embed=nextcord.Embed(
+                    description=f"⏳ Lots of code is being run right now, yours is number {position} in line",
+                    color=BLUE,
+                ),
+                reference=message,
+                mention_author=False,
+            )
+
         self.logger.debug(f"Running code:\n{code}")
-        stdout, stderr = await proc.communicate(data)
-        out, duration = self._split_run_time(stdout.decode())
+        try:
+            result = await self._runner_queue.run(
+                member.id if member else 0,
+                message.id if message else None,
+                mode,
+                code,
+                user_input,
+                restricted,
+                engine,
+                on_queued=on_queued if message else None,
+            )
+        except RunnerQueueFull:
+            return (
+                "",
+                "Beginnerpy.RunnerBusy: Too much code is waiting to run, try again in a minute",
+                0,
+            )
+        finally:
+            if queued_message:
+                await queued_message.delete()
+
+        out, stderr, duration = result.stdout, result.stderr, result.duration
+        self.logger.debug(
+            f"Done {duration} (CPU {result.cpu_time / 1_000_000:0.4f}ms, peak RSS {result.peak_rss:,} bytes, "
+            f"exit status {result.exit_status})\n{out}\n{stderr}"
+        )
+        if cacheable and self._runner_cache.cacheable_result(out, stderr):
+            self._runner_cache.set(cache_key, (out, stderr, duration))
 
-        self.logger.debug(f"Done {duration}\n{out}\n{stderr}\n{duration}")
-        return out, stderr.decode(), duration
+        return out, stderr, duration
 
     @Cog.command()
     async def eval(self, ctx, *, content):
@@ -389,7 +470,12 @@ class CodeRunner(Cog):
 
         code_message = f"\n```py\n>>> {code}"
 
-        out, err, duration = await self.code_runner("eval", code)
+        try:
+            out, err, duration = await self.code_runner(
+                "eval", code, message=ctx.message, member=ctx.author
+            )
+        except RunnerJobCancelled:
+            return
 
         output = out
         if err:
@@ -422,13 +508,18 @@ class CodeRunner(Cog):
         code_message = f"{ctx.author.mention} here are the docs you requested"
         code_message += f"\n```py\n{code}```"
 
-        message, exceptions = await self.code_runner("docs", code)
+        try:
+            output, exceptions, _ = await self.code_runner(
+                "docs", code, message=ctx.message, member=ctx.author
+            )
+        except RunnerJobCancelled:
+            return
 
         if exceptions:
             title = "Code Docs - Unable to retrieve"
             color = 0xEA4335
+            output = exceptions
 
-        output = "\n".join(message)
         await ctx.send(
             embed=nextcord.Embed(
                 title=title, description=f"```{output}\n```", color=color
@@ -437,14 +528,6 @@ class CodeRunner(Cog):
             mention_author=True,
         )
 
-    def _split_run_time(self, content: str):
-        parts = re.match(r"^(.+?)?\n\^{4}(\d+)\^{4}$", content, re.DOTALL)
-        if parts:
-            parts = parts.groups()
-            if len(parts) == 2 and parts[-1].isdigit():
-                return parts[0] if parts[0] else "", int(parts[1]) / 1000000
-        return content, 0
-
 
 def setup(client):
     client.add_cog(CodeRunner(client))
@@ -12,8 +12,12 @@ class Kudos(Cog):
     def __init__(self, client):
         super().__init__(client)
         self.dev_author = int(os.environ.get("DEV_AUTHOR_ID", 0))
+        self._kudos_queue = kudos.KudosQueue()
         self._reactions = {}
 
+    def cog_unload(self):
+        self._kudos_queue.flush()
+
     @property
     def point_values(self) -> Dict[str, int]:
         return {
@@ -43,8 +47,12 @@ class Kudos(Cog):
             )
         return self._reactions
 
+    async def ready(self):
+        kudos.backfill_kudos_totals()
+
     @Cog.command()
     async def exportkudos(self, ctx: commands.Context):
+        self._kudos_queue.flush()
         scores = kudos.get_highest_kudos(100000)
         file = BytesIO()
         file.writelines(
@@ -112,6 +120,7 @@ class Kudos(Cog):
             )
             return
 
+        self._kudos_queue.flush()
         author_kudos = kudos.get_user_kudos(ctx.author.id)
         message = [
             f"{ctx.author.mention} you have {author_kudos if author_kudos > 0 else 'no'} kudos"
@@ -140,16 +149,21 @@ class Kudos(Cog):
             "hs",
         }:
             leader_board = []
-            for index, (member_id, member_kudos) in enumerate(
-                kudos.get_highest_kudos(5)
-            ):
+            leaders = list(kudos.get_highest_kudos(5))
+            for index, (member_id, member_kudos) in enumerate(leaders):
                 member = self.server.get_member(member_id)
                 name = member.display_name if member else "*Old Member*"
                 entry = f"{index + 1}. {name} has {member_kudos} kudos"
-                if member.id == ctx.author.id:
+                if member_id == ctx.author.id:
                     entry = f"**{entry}**"
                 leader_board.append(entry)
 
+            if author_kudos > 0 and ctx.author.id not in dict(leaders):
+                rank = kudos.get_user_kudos_rank(ctx.author.id)
+                leader_board.append(
+                    f"**{rank}. {ctx.author.display_name} has {author_kudos} kudos**"
+                )
+
             embed.add_field(
                 name="Leader Board", value="\n".join(leader_board), inline=False
             )
@@ -192,28 +206,18 @@ class Kudos(Cog):
         kudos_points = self.point_values[level]
 
         if -1 < kudos_left < kudos_points:
-            await channel.send(
-                delete_after=5,
-                embed=nextcord.Embed(
-                    color=RED,
-                    description=f"{reacter.mention} you don't have enough kudos right now",
-                ),
-            )
-            for r in message.reactions:
-                if isinstance(r.emoji, str):
-                    continue
-
-                kudos_level = self.reactions.get(r.emoji.id, False)
-                if kudos_level == level:
-                    await r.remove(reacter)
-                    break
+            await self.reject_kudos(channel, message, reacter, level)
             return
 
         await self.clear_previous_kudos(message, reaction.member, level)
-        kudos.remove_kudos(reaction.message_id, reaction.user_id)
+        refunded = self._kudos_queue.given(message.id, reaction.user_id)
+        if not self.spend_pool(reaction.user_id, kudos_points - refunded):
+            # Another reaction spent the points while the previous kudos were cleared
+            await self.reject_kudos(channel, message, reacter, level)
+            return
 
-        kudos.give_user_kudos(
-            kudos_points, message.author.id, reaction.user_id, message.id
+        self._kudos_queue.give(
+            message.id, reaction.user_id, message.author.id, kudos_points
         )
 
         multiplier = self.get_pool_multiplier(reaction.member)
@@ -254,7 +258,25 @@ class Kudos(Cog):
         if message.author == reaction.user_id and not self.dev_author:
             return
 
-        kudos.remove_kudos(reaction.message_id, reaction.user_id)
+        refunded = self._kudos_queue.remove(reaction.message_id, reaction.user_id)
+        self.spend_pool(reaction.user_id, -refunded)
+
+    async def reject_kudos(self, channel, message, reacter, level):
+        await channel.send(
+            delete_after=5,
+            embed=nextcord.Embed(
+                color=RED,
+                description=f"{reacter.mention} you don't have enough kudos right now",
+            ),
+        )
+        for r in message.reactions:
+            if isinstance(r.emoji, str):
+                continue
+
+            kudos_level = self.reactions.get(r.emoji.id, False)
+            if kudos_level == level:
+                await r.remove(reacter)
+                break
 
     async def clear_previous_kudos(self, message, user, giving):
         for reaction in message.reactions:
@@ -267,18 +289,46 @@ class Kudos(Cog):
 
             await reaction.remove(user)
 
-    def points_left_to_give(self, user_id: int):
-        member = self.server.get_member(user_id)
-        multiplier = self.get_pool_multiplier(member)
-
-        if multiplier == 0:
+    def points_left_to_give(self, user_id: int) -> int:
+        pool_size = self.get_pool_size(user_id)
+        if pool_size < 0:
             return -1  # Infinite kudos
 
-        pool_size = self.pool_size * multiplier
+        return int(self.get_pool_points(user_id, pool_size, datetime.utcnow()))
 
-        since = datetime.utcnow() - timedelta(
-            minutes=self.pool_regeneration * pool_size
+    def get_pool_size(self, user_id: int) -> int:
+        multiplier = self.get_pool_multiplier(self.server.get_member(user_id))
+        return -1 if multiplier == 0 else self.pool_size * multiplier
+
+    def get_pool_points(self, user_id: int, pool_size: int, now: datetime) -> float:
+        """The giver's pool is a token bucket that regains a point every pool_regeneration minutes. Givers without
+        a saved pool get one from the kudos they've given recently."""
+        pool = kudos.get_kudos_pool(user_id)
+        if not pool:
+            pool = kudos.create_kudos_pool(
+                user_id, self.replay_kudos_given(user_id, pool_size, now), now
+            )
+
+        points, updated = pool
+        regenerated = (now - updated).total_seconds() / 60 / self.pool_regeneration
+        return min(pool_size, points + regenerated)
+
+    def spend_pool(self, user_id: int, cost: int) -> bool:
+        """Takes the cost from the giver's pool, negative costs refund points. Returns False if the giver doesn't
+        have enough points."""
+        pool_size = self.get_pool_size(user_id)
+        if pool_size < 0 or not cost:
+            return True
+
+        now = datetime.utcnow()
+        self.get_pool_points(user_id, pool_size, now)  # Makes sure the giver has a pool to spend from
+        return kudos.spend_kudos_pool(
+            user_id, cost, pool_size, self.pool_regeneration, now
         )
+
+    def replay_kudos_given(self, user_id: int, pool_size: int, now: datetime) -> int:
+        since = now - timedelta(minutes=self.pool_regeneration * pool_size)
+        self._kudos_queue.flush()
         kudos_given = kudos.get_kudos_given_since(user_id, since)
 
         if not kudos_given:
@@ -290,21 +340,17 @@ class Kudos(Cog):
             # Regenerate points since the last time they were given
             total_points = min(
                 pool_size,
-                total_points
-                + (given - last_given).seconds // 60 // self.pool_regeneration,
+                total_points + self.regenerated_points(given - last_given),
             )
             last_given = given
             # Remove the points given from the pool
             total_points = max(0, total_points - points)
 
         # Regenerate all points
-        total_points = min(
-            pool_size,
-            total_points
-            + (datetime.utcnow() - last_given).seconds // 60 // self.pool_regeneration,
-        )
+        return min(pool_size, total_points + self.regenerated_points(now - last_given))
 
-        return total_points
+    def regenerated_points(self, elapsed: timedelta) -> int:
+        return int(elapsed.total_seconds()) // 60 // self.pool_regeneration
 
     def get_pool_multiplier(self, member: nextcord.Member) -> int:
         if self.get_role("jedi council") in member.roles:
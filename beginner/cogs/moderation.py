@@ -1,6 +1,6 @@
 from beginner.cog import Cog, commands
 from beginner.models.mod_actions import ModAction
-from beginner.scheduler import schedule
+from beginner.scheduler import misfire_policy, schedule
 from beginner.snowflake import Snowflake
 from beginner.tags import tag
 from datetime import timedelta, datetime
@@ -486,6 +486,7 @@ class ModerationCog(Cog):
     def parse_user_id(self, user_tag: str) -> int:
         return int(user_tag[3:-1] if user_tag.find("!") >= 0 else user_tag[2:-1])
 
+    @misfire_policy(coalesce=True)
     @tag("schedule", "unmute-member")
     async def unmute_member(self, member_id):
         member: Member = self.server.get_member(member_id)
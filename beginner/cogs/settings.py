@@ -1,4 +1,5 @@
 from beginner.cog import Cog, commands
+from beginner.settings import VERSION_NAME
 from ast import literal_eval
 
 
@@ -6,13 +7,17 @@ class Settings(Cog):
     @Cog.command()
     @commands.has_guild_permissions(manage_messages=True)
     async def setvalue(self, ctx, raw_name, *, raw_value):
+        name = raw_name.strip()
+        if name == VERSION_NAME:
+            await ctx.send(f"Failed to set value\n```\n{name} is reserved\n```")
+            return
+
         try:
             value = literal_eval(raw_value.strip())
+            self.settings[name] = value
         except Exception as ex:
             await ctx.send(f"Failed to set value\n```\n{ex}\n```")
         else:
-            name = raw_name.strip()
-            self.settings[name] = value
             await ctx.send(f"```\n{name} = {repr(value)}```")
 
     @Cog.command()
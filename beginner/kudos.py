@@ -1,49 +1,270 @@
-from beginner.models.points import Points
+from beginner.logging import get_logger
+from beginner.models import chunked
+from beginner.models.points import KudosPools, KudosTotals, Points
+from collections import Counter
 from datetime import datetime
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
+import asyncio
 import peewee
 
 
-def give_user_kudos(kudos: int, user_id: int, giver_id: int, message_id: int):
-    kudos = Points(
-        awarded=datetime.utcnow(),
-        user_id=user_id,
-        giver_id=giver_id,
-        message_id=message_id,
-        points=kudos,
-        point_type="KUDOS",
-    )
-    kudos.save()
+BATCH_SIZE = 100  # Most kudos changes written by one statement
+FLUSH_DELAY = 2  # Seconds kudos changes are collected before they're written
+SPEND_ATTEMPTS = 3  # Times a pool that's changed while spending from it is reloaded
+
+logger = get_logger(("beginner.py", "kudos"))
+_pools: Dict[int, Tuple[float, datetime]] = {}
+
+# User ID, points & when they were given, None removes the kudos
+KudosChange = Optional[Tuple[int, int, datetime]]
 
 
 def get_user_kudos(user_id) -> int:
     kudos = (
-        Points.select(peewee.fn.SUM(Points.points))
-        .where(Points.user_id == user_id, Points.point_type == "KUDOS")
+        KudosTotals.select(KudosTotals.total)
+        .where(KudosTotals.user_id == user_id)
         .scalar()
     )
     return 0 if kudos is None else kudos
 
 
+def get_user_kudos_rank(user_id) -> int:
+    """Gets the user's place on the leaderboard, 0 if they have no kudos."""
+    kudos = get_user_kudos(user_id)
+    if kudos <= 0:
+        return 0
+
+    return KudosTotals.select().where(KudosTotals.total > kudos).count() + 1
+
+
 def get_highest_kudos(num_users: int = -1) -> List[Tuple[int, int]]:
     query = (
-        Points.select(Points.user_id, peewee.fn.SUM(Points.points))
-        .group_by(Points.user_id)
-        .order_by(peewee.fn.SUM(Points.points).desc())
-        .where(Points.point_type == "KUDOS")
+        KudosTotals.select(KudosTotals.user_id, KudosTotals.total)
+        .where(KudosTotals.total > 0)
+        .order_by(KudosTotals.total.desc())
     )
     if num_users > 0:
-        query.limit(num_users)
+        query = query.limit(num_users)
 
     return query.tuples()
 
 
-def remove_kudos(message_id: int, giver_id: int):
-    Points.delete().where(
-        Points.message_id == message_id,
-        Points.giver_id == giver_id,
-        Points.point_type == "KUDOS",
-    ).execute()
+def get_kudos_given(giver_id: int) -> Dict[int, int]:
+    """Gets the points the giver has given for each message they've given kudos for."""
+    given = (
+        Points.select(Points.message_id, peewee.fn.SUM(Points.points))
+        .where(Points.giver_id == giver_id, Points.point_type == "KUDOS")
+        .group_by(Points.message_id)
+        .tuples()
+    )
+    return {message_id: points for message_id, points in given if points}
+
+
+def apply_kudos_changes(changes: Dict[Tuple[int, int], KudosChange]):
+    """Writes a batch of changes keyed by message & giver in one transaction. Each change replaces whatever kudos
+    the giver had given for the message."""
+    totals = Counter()
+    with Points._meta.database.atomic():
+        for batch in chunked(list(changes), BATCH_SIZE):
+            where = (Points.point_type == "KUDOS") & peewee.Tuple(
+                Points.message_id, Points.giver_id
+            ).in_(batch)
+            removed = (
+                Points.select(Points.user_id, peewee.fn.SUM(Points.points))
+                .where(where)
+                .group_by(Points.user_id)
+                .tuples()
+            )
+            for user_id, points in removed:
+                totals[user_id] -= points
+            Points.delete().where(where).execute()
+
+        rows = []
+        for (message_id, giver_id), change in changes.items():
+            if change:
+                user_id, points, awarded = change
+                rows.append(
+                    {
+                        "awarded": awarded,
+                        "user_id": user_id,
+                        "giver_id": giver_id,
+                        "message_id": message_id,
+                        "points": points,
+                        "point_type": "KUDOS",
+                    }
+                )
+                totals[user_id] += points
+
+        for batch in chunked(rows, BATCH_SIZE):
+            Points.insert_many(batch).execute()
+
+        _add_to_totals(
+            {user_id: change for user_id, change in totals.items() if change}
+        )
+
+
+class KudosQueue:
+    """Collects kudos changes & writes them in batches. Changes for the same message & giver that come in before
+    the batch is written are coalesced so only the last one is saved, which keeps reaction churn out of the
+    database. A batch is written FLUSH_DELAY seconds after its first change or once it has BATCH_SIZE changes.
+
+    What each giver has given is loaded the first time they give or remove kudos & kept up to date as changes are
+    queued, so reactions only touch the database when a batch is written."""
+
+    def __init__(self, delay: float = FLUSH_DELAY, max_batch: int = BATCH_SIZE):
+        self._delay = delay
+        self._max_batch = max_batch
+        self._pending: Dict[Tuple[int, int], KudosChange] = {}
+        self._given: Dict[int, Dict[int, int]] = {}  # Giver ID to the points given for each message
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def given(self, message_id: int, giver_id: int) -> int:
+        """Points the giver has given for the message, including changes that haven't been written."""
+        return self._given_by(giver_id).get(message_id, 0)
+
+    def give(self, message_id: int, giver_id: int, user_id: int, points: int) -> int:
+        """Replaces the giver's kudos for the message, returning the points they had given before."""
+        previous = self.given(message_id, giver_id)
+        self._add(message_id, giver_id, (user_id, points, datetime.utcnow()))
+        return previous
+
+    def remove(self, message_id: int, giver_id: int) -> int:
+        """Removes the giver's kudos for the message, returning how many points were removed."""
+        previous = self.given(message_id, giver_id)
+        if previous:
+            self._add(message_id, giver_id, None)
+        return previous
+
+    def flush(self):
+        """Writes everything that's pending. Changes that fail to save are kept for the next flush."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        changes, self._pending = self._pending, {}
+        if not changes:
+            return
+
+        try:
+            apply_kudos_changes(changes)
+        except Exception:
+            logger.exception(f"Failed to save {len(changes)} kudos changes")
+            for key, change in changes.items():
+                self._pending.setdefault(key, change)
+            self._schedule_flush()
+
+    def _add(self, message_id: int, giver_id: int, change: KudosChange):
+        if change:
+            self._given_by(giver_id)[message_id] = change[1]
+        else:
+            self._given_by(giver_id).pop(message_id, None)
+
+        self._pending[message_id, giver_id] = change
+        if len(self._pending) >= self._max_batch:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def _given_by(self, giver_id: int) -> Dict[int, int]:
+        if giver_id not in self._given:
+            self._given[giver_id] = get_kudos_given(giver_id)
+        return self._given[giver_id]
+
+    def _schedule_flush(self):
+        if not self._timer:
+            self._timer = asyncio.get_running_loop().call_later(self._delay, self.flush)
+
+
+def get_kudos_pool(giver_id: int) -> Optional[Tuple[float, datetime]]:
+    """Gets the points left in the giver's pool & when it was last updated, None if they don't have a pool yet.
+    Pools are cached after they're first loaded."""
+    if giver_id not in _pools:
+        pool = KudosPools.get_or_none(KudosPools.giver_id == giver_id)
+        if not pool:
+            return None
+
+        _pools[giver_id] = (pool.points, pool.updated)
+    return _pools[giver_id]
+
+
+def create_kudos_pool(
+    giver_id: int, points: float, updated: datetime
+) -> Tuple[float, datetime]:
+    """Saves a new pool for the giver, a pool that's already been saved is kept as it is. Returns the saved pool."""
+    KudosPools.insert(
+        giver_id=giver_id, points=points, updated=updated
+    ).on_conflict_ignore().execute()
+    _pools.pop(giver_id, None)
+    return get_kudos_pool(giver_id)
+
+
+def spend_kudos_pool(
+    giver_id: int, cost: float, pool_size: int, regeneration: float, now: datetime
+) -> bool:
+    """Regenerates the giver's pool up to now & takes the cost from it in one conditional update, so reactions
+    handled at the same time can't both spend the same points. Points regenerate at one every regeneration minutes
+    and negative costs refund points. Returns False without changing the pool if the giver doesn't have enough.
+
+    The update only matches the pool as it was loaded, if it has changed since it's reloaded & tried again."""
+    for _ in range(SPEND_ATTEMPTS):
+        pool = get_kudos_pool(giver_id)
+        if not pool:
+            return False
+
+        points, updated = pool
+        regenerated = (now - updated).total_seconds() / 60 / regeneration
+        refilled = _at_most(pool_size, KudosPools.points + regenerated)
+        spent = (
+            KudosPools.update(
+                points=_at_most(pool_size, refilled - cost), updated=now
+            )
+            .where(
+                KudosPools.giver_id == giver_id,
+                KudosPools.points == points,
+                KudosPools.updated == updated,
+                refilled >= cost,
+            )
+            .execute()
+        )
+        if spent:
+            _pools[giver_id] = (
+                min(pool_size, min(pool_size, points + regenerated) - cost),
+                now,
+            )
+            return True
+
+        _pools.pop(giver_id, None)
+        if get_kudos_pool(giver_id) == pool:
+            return False  # The pool hasn't changed, there just aren't enough points
+
+    return False
+
+
+def _at_most(limit: float, value: peewee.Node) -> peewee.Node:
+    return peewee.Case(None, [(value > limit, limit)], value)
+
+
+def backfill_kudos_totals(force: bool = False):
+    """Builds the totals table from the points ledger. Does nothing if it already has totals unless forced."""
+    with Points._meta.database.atomic():
+        if not force and KudosTotals.select().exists():
+            return
+
+        KudosTotals.delete().execute()
+        KudosTotals.insert_from(
+            Points.select(Points.user_id, peewee.fn.SUM(Points.points))
+            .where(Points.point_type == "KUDOS")
+            .group_by(Points.user_id),
+            [KudosTotals.user_id, KudosTotals.total],
+        ).execute()
+
+
+def _add_to_totals(changes: Dict[int, int]):
+    for user_id, change in changes.items():
+        KudosTotals.insert(user_id=user_id, total=change).on_conflict(
+            conflict_target=[KudosTotals.user_id],
+            update={KudosTotals.total: KudosTotals.total + change},
+        ).execute()
 
 
 def get_kudos_given_since(giver_id: int, since: datetime):
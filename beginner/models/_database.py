@@ -1,4 +1,5 @@
 from peewee import *  # Make everything available here to simplify imports
+from playhouse.migrate import SchemaMigrator, migrate
 
 
 class Model(Model):
@@ -10,5 +11,47 @@ class Model(Model):
 def set_database(db: Database) -> None:
     """ Take a peewee database and bind it to all beginner.py models. """
     db.bind(Model.__subclasses__())
+    remove_duplicates_for_unique_fields(db, Model.__subclasses__())
     db.create_tables(Model.__subclasses__())
+    add_missing_columns(db, Model.__subclasses__())
     return
+
+
+def remove_duplicates_for_unique_fields(db: Database, models: list) -> None:
+    """ Deletes duplicate rows from existing tables where a field has been made unique but its index doesn't exist
+    yet, so the index can be created. The newest row (highest primary key) for each value is kept. """
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+
+        columns = {column.name for column in db.get_columns(table)}
+        indexed = {
+            tuple(index.columns) for index in db.get_indexes(table) if index.unique
+        }
+        primary_key = model._meta.primary_key
+        for field in model._meta.sorted_fields:
+            if (
+                field.unique
+                and field is not primary_key
+                and field.column_name in columns
+                and (field.column_name,) not in indexed
+            ):
+                newest = model.select(fn.MAX(primary_key)).group_by(field)
+                model.delete().where(primary_key.not_in(newest)).execute()
+
+
+def add_missing_columns(db: Database, models: list) -> None:
+    """ Adds columns for fields that were added to models after their tables were created. The new fields need to
+    be nullable or have a default. """
+    migrator = SchemaMigrator.from_database(db)
+    operations = []
+    for model in models:
+        table = model._meta.table_name
+        columns = {column.name for column in db.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in columns:
+                operations.append(migrator.add_column(table, field.column_name, field))
+
+    if operations:
+        migrate(*operations)
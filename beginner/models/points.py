@@ -8,3 +8,14 @@ class Points(models.Model):
     message_id = models.BigIntegerField(null=True)
     points = models.IntegerField()
     point_type = models.CharField(max_length=32)
+
+
+class KudosTotals(models.Model):
+    user_id = models.BigIntegerField(primary_key=True)
+    total = models.IntegerField(default=0, index=True)  # Kept in sync by beginner.kudos
+
+
+class KudosPools(models.Model):
+    giver_id = models.BigIntegerField(primary_key=True)
+    points = models.FloatField()  # Points left to give as of updated
+    updated = models.DateTimeField()
@@ -1,5 +1,4 @@
 import beginner.models as models
-import pickle
 
 
 class Scheduler(models.Model):
@@ -7,4 +6,8 @@ class Scheduler(models.Model):
     name = models.CharField(max_length=64)
     when = models.DateTimeField(formats="%Y-%m-%d %H:%M")
     tag = models.CharField(max_length=64)  # Used to identify the callback
-    payload = models.CharField(max_length=256)
+    payload = models.CharField(max_length=256, default="")  # Legacy pickled payload
+    data = models.BlobField(null=True)  # Encoded by beginner.serialization
+
+    class Meta:
+        indexes = ((("name", "when"), False),)
@@ -2,5 +2,6 @@ import beginner.models as models
 
 
 class Settings(models.Model):
-    name = models.CharField(max_length=256)
-    value = models.CharField(max_length=2048)
+    name = models.CharField(max_length=256, unique=True)
+    value = models.CharField(max_length=2048, default="")  # Legacy pickled value
+    data = models.BlobField(null=True)  # Encoded by beginner.serialization
@@ -1,22 +1,33 @@
-import ast
 import contextlib
 import inspect
 import io
 import json
 import pathlib
 import resource
+import select
 import signal
+import socket
 import sys
 import time
 import traceback
 import uuid
 import hashlib
-from types import ModuleType
+from beginner.bytecode_cache import scan_and_compile
+from beginner.runner_protocol import (
+    FrameStream,
+    FrameWriter,
+    OutputLimitExceeded,
+    STDERR,
+    STDOUT,
+)
+from types import ModuleType, SimpleNamespace
 import os
 from collections import UserDict
 
 
 os.environ = {}
+CONTROL_FD = 0  # The zygote's stdin, closed by the bot when it stops
+JOB_READ_TIMEOUT = 5
 
 
 class SafeDictView(UserDict):
@@ -161,12 +172,17 @@ class Executer:
         self.name_whitelist = name_whitelist
         self.dunder_whitelist = dunder_whitelist
         self.import_whitelist = import_whitelist
+        self.allowed_dunder_names = frozenset(name_whitelist) | frozenset(dunder_whitelist)
+        self.allowed_dunder_attributes = frozenset(dunder_whitelist)
 
         self.globals = {"__name__": "__main__"}
         self.locals = {}
         self.stdin = io.StringIO()
 
         self.exception = False
+        self.exit_code = 0
+        self.duration = 0
+        self._builtins_templates = {}
 
         signal.signal(signal.SIGXCPU, self.cpu_time_exceeded)
         signal.signal(signal.SIGALRM, self.script_timed_out)
@@ -177,14 +193,14 @@ class Executer:
     def script_timed_out(self, signo, frame):
         raise ScriptTimedOut()
 
-    def dunder_attributes(self, code_tree):
-        attributes = set()
-        for node in ast.walk(code_tree):
-            if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
-                attributes.add(node.attr)
-        return attributes
-
     def generate_builtins(self, restricted=True):
+        """Gets a fresh copy of the builtins for the restriction level, the filtered & wrapped builtins are only
+        built the first time each level is needed, nested exec/eval calls just copy them."""
+        if restricted not in self._builtins_templates:
+            self._builtins_templates[restricted] = self._build_builtins(restricted)
+        return self._builtins_templates[restricted].copy()
+
+    def _build_builtins(self, restricted):
         b = __builtins__
         if not isinstance(b, dict):
             b = {name: getattr(b, name) for name in dir(b)}
@@ -197,9 +213,13 @@ class Executer:
             if "getattr" in builtins:
                 builtins["getattr"] = self.getattr
             if "exec" in builtins:
-                builtins["exec"] = lambda *a, **k: self.exec(*a, runner=exec, **k)
+                builtins["exec"] = lambda code, globals=None, locals=None: self.exec(
+                    code, globals, locals, runner=exec
+                )
             if "eval" in builtins:
-                builtins["eval"] = lambda *a, **k: self.exec(*a, runner=eval, **k)
+                builtins["eval"] = lambda code, globals=None, locals=None: self.exec(
+                    code, globals, locals, runner=eval
+                )
             if "vars" in builtins:
                 builtins["vars"] = self.vars
         if "__import__" in builtins:
@@ -261,29 +281,29 @@ class Executer:
         print(line)
         return line
 
-    def exec(self, code, runner=exec, restricted=True):
+    def exec(self, code, globals=None, locals=None, runner=exec, restricted=True):
         try:
-            code_tree = ast.parse(code, "<string>", runner.__name__)
+            scan_result, code_object = scan_and_compile(code, runner.__name__)
         except SyntaxError as excp:
-            msg, (file, line_no, column, line) = excp.args
-            spaces = " " * (column - 1)
+            spaces = " " * ((excp.offset or 1) - 1)
             sys.stderr.write(
-                f"Line {line_no}\n{line.rstrip() if line else ''}\n{spaces}^\nSyntaxError: {msg}"
+                f"Line {excp.lineno}\n{(excp.text or '').rstrip()}\n{spaces}^\nSyntaxError: {excp.msg}"
             )
             exceptions = True
         else:
-            dunder_attributes = self.dunder_attributes(code_tree)
-            if restricted and dunder_attributes - self.dunder_whitelist:
-                prohibited_attributes = ", ".join(
-                    sorted(dunder_attributes - self.dunder_whitelist)
-                )
+            prohibited_attributes = scan_result.disabled(
+                self.allowed_dunder_names, self.allowed_dunder_attributes
+            )
+            if restricted and prohibited_attributes:
                 raise NameError(
-                    f"These attributes are not whitelisted: {prohibited_attributes}"
+                    f"These attributes are not whitelisted: {', '.join(sorted(prohibited_attributes))}"
                 )
 
-            code_object = compile(code_tree, "<string>", runner.__name__)
-            ns_globals = self.generate_globals(restricted)
-            result = runner(code_object, ns_globals, ns_globals)
+            if globals is None:
+                globals = self.generate_globals(restricted)
+            else:
+                globals["__builtins__"] = self.generate_builtins(restricted)
+            result = runner(code_object, globals, globals if locals is None else locals)
             if runner == eval and not printed:
                 print(repr(result))
 
@@ -295,34 +315,32 @@ class Executer:
 
         with self.set_recursion_depth(100):
             try:
-                code_tree = ast.parse(code, "<string>", runner.__name__)
+                scan_result, code_object = scan_and_compile(code, runner.__name__)
             except SyntaxError as excp:
-                msg, (file, line_no, column, line, start, stop) = excp.args
+                column = excp.offset or 1
                 spaces = " " * (column - 1)
-                carets = "^" * (stop - column)
+                carets = "^" * ((excp.end_offset or column) - column)
                 sys.stderr.write(
-                    f"Line {line_no}\n{line.rstrip() if line else ''}\n{spaces}{carets}\nSyntaxError: {msg}"
+                    f"Line {excp.lineno}\n{(excp.text or '').rstrip()}\n{spaces}{carets}\nSyntaxError: {excp.msg}"
                 )
                 exceptions = True
             else:
-                dunder_attributes = self.dunder_attributes(code_tree)
-                if restricted and dunder_attributes - self.dunder_whitelist:
-                    prohibited_attributes = ", ".join(
-                        sorted(dunder_attributes - self.dunder_whitelist)
-                    )
+                prohibited_attributes = scan_result.disabled(
+                    self.allowed_dunder_names, self.allowed_dunder_attributes
+                )
+                if restricted and prohibited_attributes:
                     sys.stderr.write(
-                        f"NameError: These attributes are not whitelisted: {prohibited_attributes}"
+                        f"NameError: These attributes are not whitelisted: {', '.join(sorted(prohibited_attributes))}"
                     )
                     exceptions = True
 
                 if not exceptions:
-                    code_object = compile(code_tree, "<string>", runner.__name__)
+                    start = time.time_ns()
                     try:
                         ns_globals = self.generate_globals(restricted)
                         _, hard = resource.getrlimit(resource.RLIMIT_CPU)
                         resource.setrlimit(resource.RLIMIT_CPU, (2, hard))
                         signal.alarm(2)
-                        start = time.time_ns()
                         result = runner(code_object, ns_globals, ns_globals)
                         signal.alarm(0)
                         if runner == eval:
@@ -347,14 +365,19 @@ class Executer:
                         )
                     except ImportError as ex:
                         sys.stderr.write(f"ImportError: {ex.args[0]}")
+                    except OutputLimitExceeded as ex:
+                        sys.stderr.write(f"Beginnerpy.OutputLimitExceeded: {ex}")
                     except Exception as ex:
                         traceback.print_exc(limit=-1)
                     except SystemExit as se:
+                        self.exit_code = (
+                            se.code if isinstance(se.code, int) else int(se.code is not None)
+                        )
                         sys.stderr.write(
                             f"EXIT WITH CODE {0 if se.code is None else se.code}\n"
                         )
                     finally:
-                        print(f"\n^^^^{time.time_ns() - start}^^^^")
+                        self.duration = time.time_ns() - start
 
     @contextlib.contextmanager
     def set_recursion_depth(self, depth):
@@ -364,15 +387,247 @@ class Executer:
         sys.setrecursionlimit(old_depth)
 
 
-if __name__ == "__main__":
+def preload_modules(modules):
+    """Imports the whitelisted modules so that warm workers don't pay for them when running a job."""
+    for module in modules:
+        if module in {"antigravity", "this"}:
+            continue  # These have side effects when imported
+
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+
+    with contextlib.suppress(ImportError):
+        import beginner.runner_rewrite.runner
+        from beginner.runner_rewrite.policy import load_policy
+
+        load_policy()  # Compile the rewrite engine's policy before any job is forked
+        load_policy(restricted=False)
+
+
+def run_job(executer, data, writer, mode="exec"):
+    """Runs the job sending its output and a final result frame through the frame writer."""
+    runners = {"eval": eval, "exec": exec, "docs": eval}
+    mode = data.get("mode", mode)
+    runner = runners.get(mode, exec)
+    limits = {
+        "limit": data.get("max_output", 4096),
+        "tail": data.get("output_tail", 2048),
+        "kill_limit": data.get("output_limit", 1048576),
+    }
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time_ns()
+
+    def kill(message):
+        """Ends the job as soon as it writes too much output, so user code can't catch its way past the limit."""
+        _stop_limits()
+        _finish_job(
+            writer,
+            usage,
+            1,
+            time.time_ns() - start,
+            f"Beginnerpy.OutputLimitExceeded: {message}",
+        )
+        os._exit(1)
+
+    sys.stdout = FrameStream(writer, STDOUT, on_kill=kill, **limits)
+    sys.stderr = FrameStream(writer, STDERR, on_kill=kill, **limits)
+    exit_status = 0
+    try:
+        if mode == "brainfuck":
+            executer = run_brainfuck_job(data)
+        elif data.get("engine") == "rewrite":
+            executer = run_rewrite(data, mode)
+        else:
+            executer.run(
+                data["code"],
+                data["input"],
+                runner,
+                mode == "docs",
+                data.get("restricted", True),
+            )
+    except BaseException as ex:
+        _stop_limits()
+        exit_status = 1
+        with contextlib.suppress(OutputLimitExceeded):
+            _report_escaped(ex)
+    finally:
+        _stop_limits()
+        _finish_job(
+            writer,
+            usage,
+            exit_status or executer.exit_code or int(sys.stderr.written > 0),
+            executer.duration,
+        )
+
+
+def _finish_job(writer, usage, exit_status, duration, error=""):
+    """Sends the rest of the output, then the result frame with the resources used since usage was taken."""
+    sys.stdout.finish()
+    sys.stderr.finish()
+    if error:
+        writer.write(STDERR, error.encode())
+
+    finished = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time = (finished.ru_utime + finished.ru_stime) - (
+        usage.ru_utime + usage.ru_stime
+    )
+    writer.write_result(
+        exit_status,
+        int(cpu_time * 1_000_000_000),
+        finished.ru_maxrss * 1024,
+        duration,
+    )
+
+
+def _stop_limits():
+    """Stops the CPU & wall clock signals so they can't interrupt reporting the result once user code is done."""
+    signal.alarm(0)
+    signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+
+
+def _report_escaped(ex):
+    """Writes an exception that escaped the engine to stderr, the limits get the same messages the engine gives."""
+    if isinstance(ex, CPUTimeExceeded):
+        sys.stderr.write("Beginnerpy.CPUTimeError: Exceeded process CPU time limits")
+    elif isinstance(ex, ScriptTimedOut):
+        sys.stderr.write("Beginnerpy.ScriptTimedOut: Script took too long to complete")
+    elif isinstance(ex, MemoryError):
+        sys.stderr.write("MemoryError: Exceeded process memory limits")
+    elif isinstance(ex, OutputLimitExceeded):
+        sys.stderr.write(f"Beginnerpy.OutputLimitExceeded: {ex}")
+    else:
+        traceback.print_exception(ex, limit=-1)
+
+
+def run_rewrite(data, mode):
+    """Runs the job on the runner_rewrite engine, its output is written straight to the frame streams."""
+    from beginner.runner_rewrite.runner import build_runner
+
+    runner = build_runner(
+        data["code"], mode, data["input"], data.get("restricted", True), sys.stdout
+    )
+    runner.run()
+    if runner.exception:
+        sys.stderr.write(runner.exception)
+    return runner
+
+
+def run_brainfuck_job(data):
+    """Runs a Brainfuck job, the engines stop themselves once they use up their step or wall clock budget."""
+    from beginner.brainfuck_runner import run_brainfuck
+
+    start = time.time_ns()
+    out, err = run_brainfuck(
+        data.get("engine", "interpreter"),
+        data["code"],
+        data["input"],
+        data.get("max_runtime", 5),
+    )
+    try:
+        sys.stdout.write(out)
+        if err:
+            sys.stderr.write(err)
+    except OutputLimitExceeded as ex:
+        sys.stderr.write(f"Beginnerpy.OutputLimitExceeded: {ex}")
+    return SimpleNamespace(exit_code=0, duration=time.time_ns() - start)
+
+
+def serve_zygote(executer, socket_path):
+    """Forks a child for every connection on the socket so jobs start with everything already imported.
+
+    The children share the zygote's memory copy-on-write, each one reads a single JSON job from its connection, runs
+    it under the limits applied by Executer.run, and streams the results back over the connection as frames.
+
+    Stdin is a control pipe held open by the bot, the zygote removes its socket & exits once it reaches EOF so it
+    never outlives the bot, even if the bot is killed."""
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Let the kernel reap the children
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    _print("ready", flush=True)
+
+    try:
+        while True:
+            ready, _, _ = select.select([server, CONTROL_FD], [], [])
+            if CONTROL_FD in ready and not os.read(CONTROL_FD, 1):
+                break
+
+            if server in ready:
+                _fork_job(executer, server)
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(socket_path)
+
+
+def _fork_job(executer, server):
+    conn, _ = server.accept()
+    try:
+        conn.settimeout(JOB_READ_TIMEOUT)  # A client that never sends its job can't hold up the zygote
+        with conn.makefile("rb") as request:
+            data = json.loads(request.readline())
+        conn.settimeout(None)
+    except (OSError, ValueError):
+        conn.close()
+        return
+
+    _warm_cache(data)
+    if os.fork() == 0:
+        try:
+            server.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, CONTROL_FD)  # Keep user code off the control pipe
+            os.close(devnull)
+            _run_forked_job(executer, conn, data)
+        finally:
+            os._exit(0)  # Never unwind into the zygote's loop, it would remove the socket
+
+    conn.close()
+
+
+def _warm_cache(data):
+    """Scans & compiles the job's code in the zygote, the children are thrown away after a single job so this is the
+    only process where the cache lasts long enough for code that's run over & over to be found in it. Anything that
+    fails to compile is left for the child to report."""
+    if data.get("mode", "exec") not in {"eval", "exec", "docs"}:
+        return
+
+    parse_mode = "exec" if data.get("mode", "exec") == "exec" else "eval"
+    with contextlib.suppress(Exception):
+        if data.get("engine") == "rewrite":
+            from beginner.runner_rewrite.runner import SOURCE_FILENAME
+
+            scan_and_compile(data["code"], parse_mode, SOURCE_FILENAME)
+        else:
+            scan_and_compile(data["code"], parse_mode)
+
+
+def _run_forked_job(executer, conn, data):
+    with conn:
+        with conn.makefile("wb") as results:
+            writer = FrameWriter(results)
+            writer.write_pid(os.getpid())  # Lets the bot kill this job if it runs too long
+            run_job(executer, data, writer)
+
+
+def load_allowed_modules():
     with (
         pathlib.Path(__file__).parent / "allowed_modules.txt"
     ).open() as allowed_modules_file:
-        allowed_modules = list(
+        return list(
             line.strip() for line in allowed_modules_file.readlines() if line.strip()
         )
 
-    executer = Executer(
+
+def create_executer(allowed_modules):
+    return Executer(
         {
             "__import__",
             "__build_class__",
@@ -487,10 +742,17 @@ if __name__ == "__main__":
         },
         allowed_modules,
     )
-    data = json.loads(sys.stdin.read(-1))
-    runners = {"eval": eval, "exec": exec, "docs": eval}
+
+
+if __name__ == "__main__":
+    allowed_modules = load_allowed_modules()
     arg = len(sys.argv) < 2 or sys.argv[1]
-    runner = runners.get(arg, exec)
-    executer.run(
-        data["code"], data["input"], runner, arg == "docs", data.get("restricted", True)
-    )
+    if arg in {"worker", "zygote"}:
+        preload_modules(allowed_modules)
+
+    executer = create_executer(allowed_modules)
+    if arg == "zygote":
+        serve_zygote(executer, sys.argv[2])
+    else:
+        with os.fdopen(int(sys.argv[2]), "wb") as results:
+            run_job(executer, json.loads(sys.stdin.read(-1)), FrameWriter(results), arg)
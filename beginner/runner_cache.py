@@ -0,0 +1,193 @@
+from __future__ import annotations
+from beginner.config import scope_getter
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+import ast
+import hashlib
+import json
+import re
+import time
+
+
+# Only runs that import nothing but these can be cached, anything else could read the clock or randomness
+DETERMINISTIC_MODULES = frozenset(
+    {
+        "abc",
+        "array",
+        "base64",
+        "binascii",
+        "bisect",
+        "calendar",
+        "cmath",
+        "collections",
+        "collections.abc",
+        "contextlib",
+        "copy",
+        "copyreg",
+        "dataclasses",
+        "decimal",
+        "enum",
+        "fractions",
+        "functools",
+        "hashlib",
+        "heapq",
+        "hmac",
+        "io",
+        "itertools",
+        "json",
+        "math",
+        "numbers",
+        "numpy",
+        "operator",
+        "pprint",
+        "re",
+        "reprlib",
+        "statistics",
+        "string",
+        "stringprep",
+        "struct",
+        "textwrap",
+        "types",
+        "typing",
+        "unicodedata",
+        "urllib.parse",
+    }
+)
+# Names that reach the clock or randomness, even through a module that re-exports them (calendar.datetime,
+# statistics.random, numpy.random), along with id/hash/object & sets, whose output changes between runs
+NONDETERMINISTIC_NAMES = frozenset(
+    {
+        "SystemRandom",
+        "__import__",
+        "_random",
+        "_strptime",
+        "datetime",
+        "default_rng",
+        "difference",
+        "frozenset",
+        "getrandbits",
+        "hash",
+        "id",
+        "intersection",
+        "monotonic",
+        "monotonic_ns",
+        "now",
+        "object",
+        "perf_counter",
+        "perf_counter_ns",
+        "process_time",
+        "process_time_ns",
+        "random",
+        "secrets",
+        "set",
+        "symmetric_difference",
+        "time",
+        "time_ns",
+        "timeit",
+        "today",
+        "union",
+        "urandom",
+        "utcnow",
+        "uuid",
+    }
+)
+IDENTITY_REPR = re.compile(r" at 0x[0-9a-fA-F]+")  # Default reprs show the object's address
+UNCACHEABLE_ERRORS = (
+    "Beginnerpy.CPUTimeError",
+    "Beginnerpy.RunnerBusy",
+    "Beginnerpy.RunnerError",
+    "Beginnerpy.ScriptTimedOut",
+    "MemoryError",
+)
+
+
+def create_runner_cache() -> RunnerCache:
+    settings = scope_getter("runner")
+    return RunnerCache(
+        max_size=settings("cache_size", default=256),
+        ttl=settings("cache_ttl", default=600),
+    )
+
+
+class RunnerCache:
+    """LRU cache of sandbox results keyed on a hash of everything that determines the output of a run.
+
+    Runs that import modules not known to be deterministic, use anything time or randomness based, iterate sets,
+    show object addresses, or that failed because of the load on the host, are never cached since running them
+    again could give a different result."""
+
+    def __init__(self, max_size: int = 256, ttl: float = 600):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._results: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+
+    @staticmethod
+    def key(
+        mode: str, code: str, user_input: str, restricted: bool, engine: str = "legacy"
+    ) -> str:
+        return hashlib.sha256(
+            json.dumps([engine, mode, code, user_input, restricted]).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        if key not in self._results:
+            return None
+
+        expires, result = self._results[key]
+        if expires < time.monotonic():
+            del self._results[key]
+            return None
+
+        self._results.move_to_end(key)
+        return result
+
+    def set(self, key: str, result: Any):
+        self._results[key] = (time.monotonic() + self._ttl, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self._max_size:
+            self._results.popitem(last=False)
+
+    def cacheable(self, mode: str, code: str) -> bool:
+        return self._max_size > 0 and is_deterministic(code, mode)
+
+    @staticmethod
+    def cacheable_result(stdout: str, stderr: str) -> bool:
+        if IDENTITY_REPR.search(stdout) or IDENTITY_REPR.search(stderr):
+            return False
+
+        return not any(error in stderr for error in UNCACHEABLE_ERRORS)
+
+
+def is_deterministic(code: str, mode: str = "exec") -> bool:
+    """Checks that the code only imports modules known to be deterministic and never names anything that reaches
+    the clock, randomness, object identities or sets, whether directly, through an attribute chain, a from-import
+    or a string passed to getattr & friends."""
+    try:
+        tree = ast.parse(code, "<string>", "exec" if mode == "exec" else "eval")
+    except SyntaxError:
+        return True  # The runner will give the same syntax error every time
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = set()
+            modules = {alias.name for alias in node.names}
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                return False
+            names = {alias.name for alias in node.names}
+            modules = {node.module}
+        elif isinstance(node, ast.Name):
+            names, modules = {node.id}, set()
+        elif isinstance(node, ast.Attribute):
+            names, modules = {node.attr}, set()
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            names, modules = set(node.value.split(".")), set()
+        elif isinstance(node, (ast.Set, ast.SetComp)):
+            return False
+        else:
+            continue
+
+        if names & NONDETERMINISTIC_NAMES or modules - DETERMINISTIC_MODULES:
+            return False
+
+    return True
@@ -0,0 +1,284 @@
+from __future__ import annotations
+from asyncio.subprocess import Process
+from beginner.config import scope_getter
+from beginner.logging import get_logger
+from beginner.runner_protocol import RunnerResult, read_pid, read_result
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Optional, Set
+import asyncio
+import contextlib
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+
+def create_runner() -> RunnerPool | RunnerZygote:
+    """Creates the sandbox runner backend selected in the runner config scope."""
+    settings = scope_getter("runner")
+    output_limits = OutputLimits(
+        head=settings("max_output", default=4096),
+        tail=settings("output_tail", default=2048),
+        kill=settings("output_limit", default=1048576),
+    )
+    if settings("backend", env_name="RUNNER_BACKEND", default="pool") == "zygote":
+        return RunnerZygote(settings("socket_path"), output_limits=output_limits)
+
+    return RunnerPool(
+        size=settings("pool_size", env_name="RUNNER_POOL_SIZE", default=2),
+        max_idle=settings("max_idle", default=3600),
+        output_limits=output_limits,
+    )
+
+
+@dataclass(frozen=True)
+class OutputLimits:
+    """How much of each output stream is kept from the start (head) and end (tail) of a run, and how much can be
+    written before the run is stopped (kill)."""
+
+    head: int = 4096
+    tail: int = 2048
+    kill: int = 1048576
+
+    @property
+    def max_read(self) -> int:
+        return self.head + self.tail + 256  # Leave room for the skipped output marker
+
+
+def encode_job(
+    mode: str,
+    code: str,
+    user_input: str,
+    restricted: bool,
+    limits: OutputLimits,
+    engine: str = "legacy",
+) -> bytes:
+    return json.dumps(
+        {
+            "engine": engine,
+            "mode": mode,
+            "code": code,
+            "input": user_input,
+            "restricted": restricted,
+            "max_output": limits.head,
+            "output_tail": limits.tail,
+            "output_limit": limits.kill,
+        }
+    ).encode()
+
+
+@dataclass
+class RunnerWorker:
+    proc: Process
+    results_fd: int
+    started: float = field(default_factory=time.monotonic)
+
+
+class RunnerPool:
+    """Keeps a number of pre-warmed sandbox workers ready to take a job.
+
+    Each worker is a `python -m beginner.runner worker` process that has already imported the runner and the
+    whitelisted modules and is blocked waiting for a job on stdin, results come back as frames on a pipe that is
+    passed to the worker as its own fd. Workers are single use, once a worker has been
+    handed a job a fresh one is started in the background to take its place. Idle workers older than max_idle
+    seconds are recycled when they're next reached so that nothing lingers forever."""
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_idle: float = 3600,
+        output_limits: OutputLimits = OutputLimits(),
+    ):
+        self.logger = get_logger(("beginner.py", "RunnerPool"))
+        self._size = max(0, size)
+        self._max_idle = max_idle
+        self._output_limits = output_limits
+        self._idle: Deque[RunnerWorker] = deque()
+        self._spawning: Set[asyncio.Task] = set()
+        self._closed = False
+
+    async def run(
+        self,
+        mode: str,
+        code: str,
+        user_input: str = "",
+        restricted: bool = True,
+        engine: str = "legacy",
+    ) -> RunnerResult:
+        """Hands the job to a warm worker and reads its result frames."""
+        worker = await self._acquire()
+        self.fill()
+        reader = asyncio.StreamReader()
+        transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader),
+            os.fdopen(worker.results_fd, "rb", buffering=0),
+        )
+        try:
+            worker.proc.stdin.write(
+                encode_job(
+                    mode, code, user_input, restricted, self._output_limits, engine
+                )
+            )
+            await worker.proc.stdin.drain()
+            worker.proc.stdin.close()
+            return await read_result(reader, self._output_limits.max_read)
+        finally:
+            transport.close()
+            await self._retire(worker, close_fd=False)
+
+    def fill(self):
+        """Starts enough workers in the background to bring the pool back up to size."""
+        if self._closed:
+            return
+
+        for _ in range(self._size - len(self._idle) - len(self._spawning)):
+            task = asyncio.create_task(self._add_worker())
+            self._spawning.add(task)
+            task.add_done_callback(self._spawning.discard)
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._spawning):
+            task.cancel()
+
+        while self._idle:
+            await self._retire(self._idle.popleft())
+
+    async def _acquire(self) -> RunnerWorker:
+        now = time.monotonic()
+        while self._idle:
+            worker = self._idle.popleft()
+            if worker.proc.returncode is None and now - worker.started < self._max_idle:
+                return worker
+
+            await self._retire(worker)
+
+        self.logger.debug("No warm runner available, starting one cold")
+        return await self._spawn()
+
+    async def _add_worker(self):
+        worker = await self._spawn()
+        if self._closed:
+            await self._retire(worker)
+            return
+
+        self._idle.append(worker)
+
+    async def _retire(self, worker: RunnerWorker, close_fd: bool = True):
+        if close_fd:
+            os.close(worker.results_fd)
+
+        if worker.proc.returncode is None:
+            worker.proc.kill()
+        await worker.proc.wait()
+
+    async def _spawn(self) -> RunnerWorker:
+        read_fd, write_fd = os.pipe()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "beginner.runner",
+                "worker",
+                str(write_fd),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                pass_fds=(write_fd,),
+            )
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+
+        return RunnerWorker(proc, read_fd)
+
+
+class RunnerZygote:
+    """Runs every job in a child forked from a single long lived `python -m beginner.runner zygote` process.
+
+    The zygote imports the runner and the whitelisted modules once, the children share those pages copy-on-write so
+    concurrent runs don't each cost a full interpreter. Jobs are sent over a unix socket, one connection per job. The
+    zygote is started on first use and restarted if it ever dies. Its stdin is a pipe that only the bot holds open,
+    so the zygote exits when the bot does however the bot goes down."""
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        output_limits: OutputLimits = OutputLimits(),
+    ):
+        self.logger = get_logger(("beginner.py", "RunnerZygote"))
+        self._output_limits = output_limits
+        self._socket_path = socket_path or os.path.join(
+            tempfile.gettempdir(), f"beginner-runner-{os.getpid()}.sock"
+        )
+        self._proc: Optional[Process] = None
+        self._lock = asyncio.Lock()
+
+    async def run(
+        self,
+        mode: str,
+        code: str,
+        user_input: str = "",
+        restricted: bool = True,
+        engine: str = "legacy",
+    ) -> RunnerResult:
+        """Hands the job to a freshly forked child and reads its result frames. The child is killed if the run is
+        cancelled before it finishes."""
+        await self._start()
+        reader, writer = await asyncio.open_unix_connection(self._socket_path)
+        pid = None
+        try:
+            writer.write(
+                encode_job(
+                    mode, code, user_input, restricted, self._output_limits, engine
+                )
+                + b"\n"
+            )
+            await writer.drain()
+            pid = await read_pid(reader)
+            return await read_result(reader, self._output_limits.max_read)
+        except asyncio.CancelledError:
+            if pid:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+            raise
+        finally:
+            writer.close()
+
+    def fill(self):
+        """Starts the zygote in the background so the first job doesn't have to wait on it."""
+        asyncio.create_task(self._start())
+
+    async def close(self):
+        if self._proc and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._socket_path)
+
+    async def _start(self):
+        async with self._lock:
+            if self._proc and self._proc.returncode is None:
+                return
+
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._socket_path)  # Left behind by a zygote that didn't exit cleanly
+
+            self.logger.debug(f"Starting runner zygote on {self._socket_path}")
+            self._proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "beginner.runner",
+                "zygote",
+                self._socket_path,
+                stdin=asyncio.subprocess.PIPE,  # The zygote exits when this closes
+                stdout=asyncio.subprocess.PIPE,
+                # Keep numpy from starting a thread pool that the forked children would inherit
+                env={**os.environ, "OPENBLAS_NUM_THREADS": "1"},
+            )
+            await self._proc.stdout.readline()  # Wait for the zygote to be listening
@@ -0,0 +1,191 @@
+"""Framed protocol used by the sandbox runner to send results back to the bot.
+
+Every frame is a 1 byte type and a 4 byte length followed by that many bytes of payload. The runner sends STDOUT &
+STDERR frames as the user's code writes, and finishes with a single RESULT frame holding the exit status, CPU time,
+peak RSS & wall time. Frames are written to a dedicated fd so nothing the user prints can be mistaken for them. Runners
+forked by the zygote start with a PID frame so the bot can kill them.
+
+Output is capped at the source. Once a stream has sent its limit the runner only keeps a rolling tail of what is
+written, when the run ends it sends a SKIPPED frame with the number of bytes that were dropped followed by the tail."""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Callable, Optional, Tuple
+import asyncio
+import io
+import struct
+
+
+STDOUT = 1
+STDERR = 2
+RESULT = 3
+SKIPPED = 4
+PID = 5
+
+HEADER = struct.Struct("!BI")
+RESULT_PAYLOAD = struct.Struct("!iqqq")  # Exit status, CPU ns, peak RSS bytes, wall ns
+SKIPPED_PAYLOAD = struct.Struct("!Bq")  # Stream type, bytes dropped
+PID_PAYLOAD = struct.Struct("!i")  # PID of a forked runner, sent before anything else
+
+
+@dataclass
+class RunnerResult:
+    stdout: str = ""
+    stderr: str = ""
+    exit_status: int = 0
+    cpu_time: int = 0
+    peak_rss: int = 0
+    wall_time: int = 0
+    complete: bool = False
+
+    @property
+    def duration(self) -> float:
+        """Wall time in milliseconds."""
+        return self.wall_time / 1_000_000
+
+
+class FrameWriter:
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    def write(self, frame_type: int, payload: bytes):
+        self._file.write(HEADER.pack(frame_type, len(payload)) + payload)
+        self._file.flush()
+
+    def write_pid(self, pid: int):
+        self.write(PID, PID_PAYLOAD.pack(pid))
+
+    def write_result(
+        self, exit_status: int, cpu_time: int, peak_rss: int, wall_time: int
+    ):
+        self.write(
+            RESULT, RESULT_PAYLOAD.pack(exit_status, cpu_time, peak_rss, wall_time)
+        )
+
+
+class FrameStream(io.TextIOBase):
+    """Text stream that sends what is written to it as frames of a single type, buffering small writes.
+
+    Only the first limit bytes are sent as they're written, after that just the last tail bytes are held on to
+    until finish is called. Once more than kill_limit bytes have been written on_kill is called to end the run, it
+    isn't expected to return. Without on_kill every write past the limit raises OutputLimitExceeded."""
+
+    def __init__(
+        self,
+        writer: FrameWriter,
+        frame_type: int,
+        limit: int = 4096,
+        tail: int = 2048,
+        kill_limit: int = 0,
+        buffer_size: int = 4096,
+        on_kill: Optional[Callable[[str], None]] = None,
+    ):
+        self._writer = writer
+        self._frame_type = frame_type
+        self._limit = limit
+        self._tail_size = tail
+        self._kill_limit = kill_limit
+        self._buffer_size = buffer_size
+        self._on_kill = on_kill
+        self._buffer = bytearray()
+        self._tail = bytearray()
+        self._sent = 0
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        data = text.encode(errors="replace")
+        self.written += len(data)
+        space = self._limit - self._sent - len(self._buffer)
+        if space > 0:
+            self._buffer += data[:space]
+            data = data[space:]
+
+        if data and self._tail_size:
+            self._tail += data
+            del self._tail[: -self._tail_size]
+
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+        if self._kill_limit and self.written > self._kill_limit:
+            message = f"Wrote more than the {self._kill_limit:,} bytes of output allowed"
+            if self._on_kill:
+                self._on_kill(message)
+            raise OutputLimitExceeded(message)
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            self._writer.write(self._frame_type, bytes(self._buffer))
+            self._sent += len(self._buffer)
+            self._buffer.clear()
+
+    def finish(self):
+        """Sends anything still buffered and the tail of the output if any had to be dropped."""
+        self.flush()
+        skipped = self.written - self._sent - len(self._tail)
+        if skipped > 0:
+            self._writer.write(SKIPPED, SKIPPED_PAYLOAD.pack(self._frame_type, skipped))
+        if self._tail:
+            self._writer.write(self._frame_type, bytes(self._tail))
+            self._tail.clear()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Tuple[int, bytes]]:
+    """Reads the next frame, None once the runner has closed its end."""
+    try:
+        frame_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+        return frame_type, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def read_frames(reader: asyncio.StreamReader) -> AsyncIterator[Tuple[int, bytes]]:
+    while frame := await read_frame(reader):
+        yield frame
+
+
+async def read_pid(reader: asyncio.StreamReader) -> Optional[int]:
+    """Reads the PID frame a forked runner starts with, None if the runner didn't send one."""
+    frame = await read_frame(reader)
+    if not frame or frame[0] != PID:
+        return None
+
+    (pid,) = PID_PAYLOAD.unpack(frame[1])
+    return pid
+
+
+async def read_result(
+    reader: asyncio.StreamReader, max_output: int = 65536
+) -> RunnerResult:
+    """Reads frames until the runner is done, keeping at most max_output bytes of each output stream. Skipped
+    output is marked where it was dropped."""
+    result = RunnerResult()
+    output = {STDOUT: bytearray(), STDERR: bytearray()}
+    async for frame_type, payload in read_frames(reader):
+        if frame_type in output:
+            space = max_output - len(output[frame_type])
+            output[frame_type] += payload[: max(0, space)]
+        elif frame_type == SKIPPED:
+            stream, skipped = SKIPPED_PAYLOAD.unpack(payload)
+            output[stream] += f"\n.\n.\nRemoved {skipped:,} bytes\n.\n.\n".encode()
+        elif frame_type == RESULT:
+            (
+                result.exit_status,
+                result.cpu_time,
+                result.peak_rss,
+                result.wall_time,
+            ) = RESULT_PAYLOAD.unpack(payload)
+            result.complete = True
+
+    result.stdout = output[STDOUT].decode(errors="replace")
+    result.stderr = output[STDERR].decode(errors="replace")
+    if not result.complete:
+        result.stderr += "\nBeginnerpy.RunnerError: The runner exited unexpectedly"
+    return result
+
+
+class OutputLimitExceeded(BaseException):
+    """Raised when a run writes too much output. It isn't an Exception so user code can't easily swallow it."""
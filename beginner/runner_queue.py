@@ -0,0 +1,170 @@
+from __future__ import annotations
+from beginner.config import scope_getter
+from beginner.exceptions import BeginnerException
+from beginner.logging import get_logger
+from beginner.runner_pool import RunnerPool, RunnerZygote, create_runner
+from beginner.runner_protocol import RunnerResult
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+import asyncio
+import collections
+import os
+
+
+def create_runner_queue() -> RunnerQueue:
+    """Creates a runner queue in front of the configured sandbox runner backend."""
+    settings = scope_getter("runner")
+    return RunnerQueue(
+        create_runner(),
+        concurrency=settings("concurrency", default=0),
+        max_depth=settings("max_queue", default=25),
+        timeout=settings("timeout", default=10),
+    )
+
+
+@dataclass(eq=False)
+class RunnerJob:
+    user_id: int
+    message_id: Optional[int]
+    args: Tuple
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+    task: Optional[asyncio.Task] = None
+
+
+class RunnerQueue:
+    """Limits how many sandbox runs happen at once and shares the slots fairly between users.
+
+    Waiting jobs are kept in a queue per user and the users are served round-robin, so one person spamming runs
+    can't push everyone else to the back. Concurrency defaults to the number of CPUs. Once max_depth jobs are
+    waiting new jobs are refused. Jobs can be cancelled by the ID of the message that requested them. A job that
+    hasn't finished after timeout seconds is cancelled, which kills its runner, so a hung runner can't hold a slot."""
+
+    def __init__(
+        self,
+        runner: RunnerPool | RunnerZygote,
+        concurrency: int = 0,
+        max_depth: int = 25,
+        timeout: float = 10,
+    ):
+        self.logger = get_logger(("beginner.py", "RunnerQueue"))
+        self.runner = runner
+        self._concurrency = concurrency or os.cpu_count() or 1
+        self._max_depth = max_depth
+        self._timeout = timeout
+        self._queues: OrderedDict[int, Deque[RunnerJob]] = OrderedDict()
+        self._running: Set[RunnerJob] = set()
+        self._jobs: Dict[int, RunnerJob] = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(map(len, self._queues.values()))
+
+    async def run(
+        self,
+        user_id: int,
+        message_id: Optional[int],
+        *args,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+    ) -> RunnerResult:
+        """Queues a job for the runner and waits for its result. The on_queued callback is awaited with the
+        job's position if it can't start right away."""
+        if self.depth >= self._max_depth:
+            raise RunnerQueueFull(f"There are already {self.depth} jobs waiting to run")
+
+        job = RunnerJob(user_id, message_id, args)
+        self._queues.setdefault(user_id, collections.deque()).append(job)
+        if message_id is not None:
+            self._jobs[message_id] = job
+
+        try:
+            self._dispatch()
+            if on_queued and not job.task and not job.future.done():
+                await on_queued(self.position(job))
+
+            return await job.future
+        finally:
+            if self._jobs.get(message_id) is job:
+                del self._jobs[message_id]
+
+    def cancel(self, message_id: int) -> bool:
+        """Cancels the job started by the message, whether it's still waiting or already running."""
+        job = self._jobs.pop(message_id, None)
+        if not job or job.future.done():
+            return False
+
+        if job.task:
+            job.task.cancel()
+        else:
+            self._remove(job)
+            job.future.set_exception(RunnerJobCancelled("The message was deleted"))
+
+        self.logger.debug(f"Cancelled the job for message {message_id}")
+        return True
+
+    def position(self, job: RunnerJob) -> int:
+        """The 1 based position the job will start at given round-robin scheduling."""
+        users = list(self._queues)
+        user_index = users.index(job.user_id)
+        job_index = self._queues[job.user_id].index(job)
+        ahead = 0
+        for index, user in enumerate(users):
+            waiting = len(self._queues[user])
+            ahead += min(waiting, job_index)
+            if index < user_index and waiting > job_index:
+                ahead += 1
+
+        return ahead + 1
+
+    def _dispatch(self):
+        while self._queues and len(self._running) < self._concurrency:
+            user_id, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            if jobs:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+
+            self._running.add(job)
+            job.task = asyncio.create_task(self._run(job))
+            job.task.add_done_callback(lambda task, job=job: self._finished(job, task))
+
+    async def _run(self, job: RunnerJob) -> RunnerResult:
+        try:
+            return await asyncio.wait_for(self.runner.run(*job.args), self._timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Killed a run for {job.user_id} that took more than {self._timeout} seconds"
+            )
+            return RunnerResult(
+                stderr="Beginnerpy.ScriptTimedOut: Script took too long to complete",
+                exit_status=1,
+            )
+
+    def _finished(self, job: RunnerJob, task: asyncio.Task):
+        self._running.discard(job)
+        if not job.future.done():
+            if task.cancelled():
+                job.future.set_exception(RunnerJobCancelled("The message was deleted"))
+            elif task.exception():
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+
+        self._dispatch()
+
+    def _remove(self, job: RunnerJob):
+        jobs = self._queues[job.user_id]
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[job.user_id]
+
+
+class RunnerQueueFull(BeginnerException):
+    pass
+
+
+class RunnerJobCancelled(BeginnerException):
+    pass
@@ -1,9 +1,32 @@
+from typing import Optional, TextIO
 import io
 
 
 class RunnerOutputBuffer:
-    def __init__(self):
-        self.buffer = io.StringIO()
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.buffer = io.StringIO() if stream is None else stream
 
     def __getattr__(self, item):
         return getattr(self.buffer, item)
+
+    def write(self, text: str) -> int:
+        return self.buffer.write(text)
+
+    def getvalue(self) -> str:
+        """Everything written so far, streams that were passed in aren't held on to so there is nothing to get."""
+        return self.buffer.getvalue() if isinstance(self.buffer, io.StringIO) else ""
+
+    def close(self):
+        if isinstance(self.buffer, io.StringIO):
+            self.buffer.close()
+
+
+class RunnerInputBuffer:
+    def __init__(self, data: str = ""):
+        self.buffer = io.StringIO(data)
+
+    def readline(self) -> str:
+        if self.buffer.tell() == len(self.buffer.getvalue()):
+            raise EOFError("Nothing left to read from stdin")
+
+        return self.buffer.readline().rstrip("\n")
@@ -1,13 +1,19 @@
-from beginner.runner.buffer import RunnerOutputBuffer
-from beginner.runner.config import RunnerConfig
-from beginner.runner.module_wrapper import ModuleWrapper, RunnerAttributeError
+from beginner.runner_rewrite.buffer import RunnerInputBuffer, RunnerOutputBuffer
+from beginner.runner_rewrite.module_wrapper import (
+    ModuleWrapper,
+    RunnerAttributeError,
+    wrap_module,
+)
+from beginner.runner_rewrite.policy import RunnerPolicy
 from typing import Any, Callable, Dict, Tuple, Union
 import bevy
+import sys
 
 
 class RunnerBuiltinWrappers(bevy.Bevy):
-    config: RunnerConfig
+    policy: RunnerPolicy
     buffer: RunnerOutputBuffer
+    stdin: RunnerInputBuffer
 
     def get(self, name: str, default: Any = None) -> Union[Callable, Any]:
         if hasattr(self, name):
@@ -18,10 +24,14 @@ class RunnerBuiltinWrappers(bevy.Bevy):
         kwargs["file"] = self.buffer
         return print(*args, **kwargs)
 
-    def safe_getattr(self, obj: Any, name: str) -> Any:
-        if name.startswith("__") and name not in self.config.get(
-            "enabled_special_attributes"
-        ):
+    def safe_input(self, prompt: str = "") -> str:
+        self.buffer.write(prompt)
+        line = self.stdin.readline()
+        self.buffer.write(f"{line}\n")
+        return line
+
+    def safe_getattr(self, obj: Any, name: str, *default) -> Any:
+        if name.startswith("__") and not self.policy.special_attribute_enabled(name):
             obj_name = (
                 obj.__name__ if hasattr(obj, "__name__") else obj.__class__.__name__
             )
@@ -29,6 +39,14 @@ class RunnerBuiltinWrappers(bevy.Bevy):
                 f"The attribute or method '{obj_name}.{name}' is disabled for security reasons"
             )
 
+        return getattr(obj, name, *default)
+
+    def safe_vars(self, *args) -> Dict[str, Any]:
+        namespace = vars(*args) if args else sys._getframe(1).f_locals
+        return {
+            name: value for name, value in namespace.items() if not name.startswith("_")
+        }
+
     def safe_import(
         self,
         name: str,
@@ -37,6 +55,6 @@ class RunnerBuiltinWrappers(bevy.Bevy):
         from_list: Tuple = tuple(),
         level: int = 0,
     ) -> Union[ModuleWrapper, Tuple[Any]]:
-        return ModuleWrapper.context(self.config).build(
-            __import__(name, globals_dict, locals_dict, from_list, level)
+        return wrap_module(
+            __import__(name, globals_dict, locals_dict, from_list, level), self.policy
         )
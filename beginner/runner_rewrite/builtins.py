@@ -1,19 +1,22 @@
-from typing import Any, Dict, Callable, Optional
-from beginner.runner.config import RunnerConfig
-from beginner.runner.builtin_wrappers import RunnerBuiltinWrappers
+from typing import Any, Dict
+from beginner.runner_rewrite.builtin_wrappers import RunnerBuiltinWrappers
+from beginner.runner_rewrite.policy import RunnerPolicy
 import bevy
 
 
 class RunnerBuiltins(bevy.Bevy, dict):
-    config: RunnerConfig
+    policy: RunnerPolicy
     wrappers: RunnerBuiltinWrappers
 
-    def __init__(self):
-        self.__enabled_builtins = self.config.get("enabled_builtins")
-
     def get_builtins(self) -> Dict[str, Any]:
+        if not self.policy.restricted:
+            builtins = dict(__builtins__)
+            builtins["print"] = self.wrappers.buffer_printer
+            builtins["input"] = self.wrappers.safe_input
+            return builtins
+
         builtins = {}
         for name, value in __builtins__.items():
-            if name in self.__enabled_builtins:
-                builtins[name] = self.wrappers.get(self.__enabled_builtins[name], value)
+            if name in self.policy.builtins:
+                builtins[name] = self.wrappers.get(self.policy.builtins[name], value)
         return builtins
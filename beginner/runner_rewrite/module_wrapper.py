@@ -1,58 +1,137 @@
-from beginner.runner.config import RunnerConfig
-from typing import Any
+from beginner.runner_rewrite.policy import RunnerPolicy
+from typing import Any, Dict, Tuple
 from types import ModuleType
 import bevy
+import os
+
+
+_wrappers: Dict[Tuple[RunnerPolicy, str], "ModuleWrapper"] = {}
 
 
 class ModuleWrapper(bevy.Bevy):
-    config: RunnerConfig
+    """Proxies a module so that only the attributes enabled by the policy can be used.
+
+    Allowed attributes are bound onto the wrapper the first time they're looked up, after that they're found on the
+    instance without going through __getattr__ so hot loops over things like math.sqrt don't pay for the checks.
+    Modules that need more than the policy can express get a subclass from MODULE_WRAPPERS."""
+
+    __policy__: RunnerPolicy  # Dunder name so that, like the module, it's hidden from the sandboxed code
+    __disabled_attributes__ = frozenset()  # Disabled even if the policy enables every attribute of the module
 
     def __init__(self, module: ModuleType):
         self.__protected_module__ = (
             module  # Use dunder name so that our getattr code will protect it
         )
-        self.__enabled_attributes = self.config.get("enabled_modules").get(
-            self.__protected_module__.__name__, []
-        )
-
-        if not self.__enabled_attributes:
+        if not self.__policy__.module_enabled(self.__protected_module__.__name__):
             raise RunnerImportError(
                 f"The module '{self.__protected_module__.__name__}' is disabled for security reasons"
             )
 
     def __getattr__(self, name: str) -> Any:
-        if name.startswith(f"_{self.__class__.__name__}__") or name.startswith("__"):
+        if name.startswith("__"):
             return super().__getattribute__(name)
 
+        if _is_mangled(name):
+            raise RunnerAttributeError(
+                f"The attribute or method '{self.__protected_module__.__name__}.{name}' is disabled for security reasons"
+            )
+
         attr = getattr(self.__protected_module__, name)
-        if not self.__enabled_attribute(name):
+        if not self.__enabled_attribute__(name):
             raise RunnerAttributeError(
                 f"The attribute or method '{self.__protected_module__.__name__}.{name}' is disabled for security reasons"
             )
 
         if isinstance(attr, ModuleType):
-            return ModuleWrapper.context(self.config).build(attr)
+            attr = wrap_module(attr, self.__policy__)
 
+        self.__dict__[name] = attr
         return attr
 
     def __setattr__(self, name: str, value: Any):
-        if (
-            not hasattr(self, "__protected_module__")
-            or name.startswith(f"_{self.__class__.__name__}__")
-            or name.startswith("__")
-        ):
+        if not hasattr(self, "__protected_module__") or name.startswith("__"):
             super().__setattr__(name, value)
             return
 
-        if not self.__enabled_attribute(name):
+        if _is_mangled(name) or not self.__enabled_attribute__(name):
             raise RunnerAttributeError(
                 f"The attribute or method '{self.__protected_module__.__name__}.{name}' is disabled for security reasons"
             )
 
         setattr(self.__protected_module__, name, value)
+        self.__dict__.pop(name, None)  # Rebound on the next lookup
+
+    def __enabled_attribute__(self, name: str) -> bool:
+        return name not in self.__disabled_attributes__ and self.__policy__.attribute_enabled(
+            self.__protected_module__.__name__, name
+        )
+
+
+class NumpyWrapper(ModuleWrapper):
+    __disabled_attributes__ = frozenset(
+        {
+            "DataSource",
+            "fromfile",
+            "fromregex",
+            "genfromtxt",
+            "load",
+            "loads",
+            "loadtxt",
+            "memmap",
+            "save",
+            "savetxt",
+            "savez",
+            "savez_compressed",
+        }
+    )
+
+
+class IOWrapper(ModuleWrapper):
+    __disabled_attributes__ = frozenset({"FileIO", "open", "open_code"})
+
+
+class PickleWrapper(ModuleWrapper):
+    """Stands in for pickle without ever unpickling anything. Dumping keeps the object & returns a random token in
+    its place, loading only accepts tokens handed out by this run, so crafted pickles never reach the unpickler."""
+
+    def __init__(self, module: ModuleType):
+        super().__init__(module)
+        self.__pickles__: Dict[bytes, Any] = {}
+
+    def dump(self, obj: Any, file: Any, *_, **__):
+        file.write(self.dumps(obj))
+
+    def dumps(self, obj: Any, *_, **__) -> bytes:
+        token = os.urandom(16)
+        self.__pickles__[token] = obj
+        return token
+
+    def load(self, file: Any, *_, **__) -> Any:
+        return self.loads(file.read())
+
+    def loads(self, data: Any, *_, **__) -> Any:
+        try:
+            return self.__pickles__[bytes(data)]
+        except (KeyError, TypeError):
+            raise RuntimeError("Unknown pickle detected") from None
+
+
+def wrap_module(module: ModuleType, policy: RunnerPolicy) -> ModuleWrapper:
+    """Gets the wrapper for the module, there is only ever one wrapper for each module under a policy. This isn't a
+    method on the wrapper since anything on the wrapper's class would shadow the module's attribute of the same name."""
+    key = policy, module.__name__
+    if key not in _wrappers:
+        wrapper = MODULE_WRAPPERS.get(module.__name__, ModuleWrapper)
+        _wrappers[key] = wrapper.context(policy).build(module)
+    return _wrappers[key]
+
+
+def _is_mangled(name: str) -> bool:
+    """Name mangled private attributes (_PickleWrapper__pickles) are the wrappers' own state, never the module's."""
+    return name.startswith("_") and not name.startswith("__") and "__" in name
+
 
-    def __enabled_attribute(self, name: str) -> bool:
-        return "*" in self.__enabled_attributes or name in self.__enabled_attributes
+MODULE_WRAPPERS = {"io": IOWrapper, "numpy": NumpyWrapper, "pickle": PickleWrapper}
 
 
 class RunnerImportError(ImportError):
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from beginner.runner_rewrite.config import RunnerConfig
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Union
+import dataclasses
+import functools
+import pathlib
+
+
+DEFAULT_CONFIG_PATH = pathlib.Path(__file__).parent.parent / "config"
+NO_ATTRIBUTES = frozenset()
+
+
+@dataclass(frozen=True, eq=False)
+class RunnerPolicy:
+    """The JSON runner config compiled into immutable lookup tables.
+
+    This is built once per process and shared by everything in the runner, so checks are plain frozenset
+    membership tests rather than dict lookups into the raw config. Policies compare by identity so they can be used
+    as cache keys."""
+
+    builtins: Mapping[str, str]
+    modules: Mapping[str, FrozenSet[str]]
+    special_attributes: FrozenSet[str]
+    wildcard_modules: FrozenSet[str] = NO_ATTRIBUTES
+    allowed_dunder_names: FrozenSet[str] = NO_ATTRIBUTES
+    restricted: bool = True
+
+    @classmethod
+    def compile(cls, config: RunnerConfig, restricted: bool = True) -> RunnerPolicy:
+        modules = {
+            name: frozenset(attributes)
+            for name, attributes in config.get("enabled_modules").items()
+        }
+        builtins = config.get("enabled_builtins")
+        special_attributes = frozenset(config.get("enabled_special_attributes"))
+        return cls(
+            builtins=MappingProxyType(dict(builtins)),
+            modules=MappingProxyType(modules),
+            special_attributes=special_attributes,
+            wildcard_modules=frozenset(
+                name for name, attributes in modules.items() if "*" in attributes
+            ),
+            allowed_dunder_names=special_attributes
+            | frozenset(name for name in builtins if name.startswith("__")),
+            restricted=restricted,
+        )
+
+    def module_enabled(self, module_name: str) -> bool:
+        return bool(self.modules.get(module_name))
+
+    def attribute_enabled(self, module_name: str, name: str) -> bool:
+        return module_name in self.wildcard_modules or name in self.modules.get(
+            module_name, NO_ATTRIBUTES
+        )
+
+    def special_attribute_enabled(self, name: str) -> bool:
+        return name in self.special_attributes
+
+
+@functools.lru_cache()
+def load_policy(
+    config_path: Union[str, pathlib.Path] = DEFAULT_CONFIG_PATH, restricted: bool = True
+) -> RunnerPolicy:
+    if not restricted:
+        return dataclasses.replace(load_policy(config_path), restricted=False)
+
+    return RunnerPolicy.compile(RunnerConfig(config_path))
@@ -6,8 +6,8 @@ import signal
 
 @dataclass
 class RunnerResourceLimits:
-    max_memory: int = field(default=1000)
-    max_cpu_time: int = field(default=1)
+    max_memory: int = field(default=1000)  # Megabytes
+    max_cpu_time: int = field(default=2)
     max_runtime: int = field(default=2)
     exception: str = field(default="")
 
@@ -19,7 +19,9 @@ class RunnerResourceLimits:
         signal.signal(signal.SIGALRM, self.script_timed_out)
 
         self._old_as_limit = resource.getrlimit(resource.RLIMIT_AS)
-        resource.setrlimit(resource.RLIMIT_AS, (self.max_memory, self._old_as_limit[1]))
+        resource.setrlimit(
+            resource.RLIMIT_AS, (self.max_memory * 1024 * 1024, self._old_as_limit[1])
+        )
 
         self._old_cpu_limit = resource.getrlimit(resource.RLIMIT_CPU)
         resource.setrlimit(
@@ -36,8 +38,8 @@ class RunnerResourceLimits:
         resource.setrlimit(resource.RLIMIT_CPU, self._old_cpu_limit)
         resource.setrlimit(resource.RLIMIT_AS, self._old_as_limit)
 
-        if exc_type in {CPUTimeExceeded, ScriptTimedOut, MemoryError}:
-            self.exception = f"{exc_type.__name__}: {exc_val}"
+        if exc_type in LIMIT_ERROR_NAMES:
+            self.exception = f"{LIMIT_ERROR_NAMES[exc_type]}: {exc_val or 'Exceeded process memory limits'}"
             return True
 
         return False
@@ -59,3 +61,11 @@ class CPUTimeExceeded(Exception):
 
 class ScriptTimedOut(Exception):
     ...
+
+
+# Named the same as the legacy runner's errors so the bot treats both engines alike
+LIMIT_ERROR_NAMES = {
+    CPUTimeExceeded: "Beginnerpy.CPUTimeError",
+    ScriptTimedOut: "Beginnerpy.ScriptTimedOut",
+    MemoryError: "MemoryError",
+}
@@ -1,68 +1,90 @@
-from beginner.runner.buffer import RunnerOutputBuffer
-from beginner.runner.builtins import RunnerBuiltins
-from beginner.runner.config import RunnerConfig
-from beginner.runner.resources import RunnerResourceLimits
-from beginner.runner.scanner import Scanner
-from beginner.runner.module_wrapper import RunnerAttributeError, RunnerImportError
-from typing import Any, Dict, Set
-import ast
+from beginner.bytecode_cache import scan_and_compile
+from beginner.runner_protocol import OutputLimitExceeded
+from beginner.runner_rewrite.buffer import RunnerInputBuffer, RunnerOutputBuffer
+from beginner.runner_rewrite.builtins import RunnerBuiltins
+from beginner.runner_rewrite.policy import RunnerPolicy, load_policy
+from beginner.runner_rewrite.resources import RunnerResourceLimits
+from beginner.runner_rewrite.scanner import ScanResult
+from beginner.runner_rewrite.module_wrapper import (
+    RunnerAttributeError,
+    RunnerImportError,
+)
+from typing import Any, Dict, FrozenSet, Optional, TextIO
 import bevy
+import contextlib
 import io
-import pathlib
+import sys
+import time
 import traceback
 
 
+SOURCE_FILENAME = "<discord>"
+
+
 class Runner(bevy.Bevy):
     buffer: RunnerOutputBuffer
     builtins: RunnerBuiltins
-    config: RunnerConfig
+    policy: RunnerPolicy
 
     def __init__(self, code: str, mode: str):
         self._code = code
         self._mode = mode
-        self._config_path = pathlib.Path(__file__).parent.parent / "config"
 
         self.output = ""
         self.exception = ""
         self.exit_code = 0
+        self.duration = 0
 
     def run(self):
+        parse_mode = "eval" if self._mode == "docs" else self._mode
         try:
-            tree = ast.parse(self._code, "<discord>", self._mode)
+            scan_result, code = scan_and_compile(
+                self._code, parse_mode, SOURCE_FILENAME
+            )
         except SyntaxError as exc:
-            msg, (file, line_no, column, line) = exc.args
-            spaces = " " * (column - 2)
-            self.exception = f'File "{file}", line {line_no}\n{line.rstrip()}\n{spaces}^\nSyntaxError: {msg}'
+            spaces = " " * ((exc.offset or 1) - 1)
+            line = (exc.text or "").rstrip()
+            self.exception = f'File "{exc.filename}", line {exc.lineno}\n{line}\n{spaces}^\nSyntaxError: {exc.msg}'
             return
 
-        scanner = Scanner(tree)
-        disabled_attributes = self.disabled_dunder_attributes(scanner)
+        disabled_attributes = self.disabled_dunder_attributes(scan_result)
         if disabled_attributes:
             self.exception = f"AttributeError: Found disabled attributes ({', '.join(sorted(disabled_attributes))})"
             return
 
-        self.preload_modules(scanner)
+        self.preload_modules(scan_result)
 
         global_ns = self.build_globals()
         limits = None
+        start = time.time_ns()
         try:
-            code = compile(tree, "<discord>", self._mode)
-            with RunnerResourceLimits() as limits:
-                if self._mode == "exec":
+            with self.recursion_limit(100), RunnerResourceLimits() as limits:
+                if parse_mode == "exec":
                     exec(code, global_ns, global_ns)
-                elif self._mode == "eval":
-                    self.buffer.writelines(repr(eval(code, global_ns, global_ns)))
+                else:
+                    result = eval(code, global_ns, global_ns)
+                    if self._mode == "docs":
+                        doc = getattr(result, "__doc__", None)
+                        self.buffer.write(f"{doc if doc and doc.strip() else 'NO DOCS'}\n")
+                    elif result is not None:
+                        self.buffer.write(f"{result!r}\n")
         except RunnerAttributeError as exc:
             self.exception = f"AttributeError: {exc.args[0]}"
         except RunnerImportError as exc:
             self.exception = f"ImportError: {exc.args[0]}"
+        except OutputLimitExceeded as exc:
+            self.exception = f"Beginnerpy.OutputLimitExceeded: {exc}"
         except SystemExit as se:
-            self.exit_code = 0 if se.code is None else se.code
+            self.exit_code = (
+                se.code if isinstance(se.code, int) else int(se.code is not None)
+            )
         except Exception as exc:
             err = io.StringIO()
             traceback.print_exc(limit=-1, file=err)
             self.exception = err.getvalue()
             err.close()
+        finally:
+            self.duration = time.time_ns() - start
 
         if limits and limits.exception:
             self.exception = limits.exception
@@ -73,25 +95,55 @@ class Runner(bevy.Bevy):
     def build_globals(self) -> Dict[str, Any]:
         return {"__name__": "__main__", "__builtins__": self.builtins.get_builtins()}
 
-    def disabled_dunder_attributes(self, scanner: Scanner) -> Set[str]:
-        attrs = scanner.get_dunder_attributes()
-        enabled_attributes = set(self.config.get("enabled_special_attributes"))
-        return attrs - enabled_attributes
+    def disabled_dunder_attributes(self, scan_result: ScanResult) -> FrozenSet[str]:
+        if not self.policy.restricted:
+            return frozenset()
+
+        return scan_result.disabled(
+            self.policy.allowed_dunder_names, self.policy.special_attributes
+        )
 
-    def preload_modules(self, scanner: Scanner):
+    def preload_modules(self, scan_result: ScanResult):
         """ Preload modules since some will fail to load once resource limits are put in place. """
-        for module in scanner.get_imports():
+        for module in scan_result.imports:
             try:
                 __import__(module)
             except ImportError:
                 return  # We don't care, this exception will be raised when the code is run, so just stop
 
+    @contextlib.contextmanager
+    def recursion_limit(self, depth: int):
+        old_depth = sys.getrecursionlimit()
+        frame, stack_depth = sys._getframe(), 0
+        while frame:  # Counting the frames directly avoids inspect.stack loading the source of every frame
+            frame, stack_depth = frame.f_back, stack_depth + 1
+        sys.setrecursionlimit(depth + stack_depth)
+        try:
+            yield
+        finally:
+            sys.setrecursionlimit(old_depth)
+
+
+def build_runner(
+    code: str,
+    mode: str,
+    user_input: str = "",
+    restricted: bool = True,
+    output: Optional[TextIO] = None,
+    policy: Optional[RunnerPolicy] = None,
+) -> Runner:
+    """Builds a runner for the code using the compiled policy. Output is collected by the runner unless an output
+    stream is given for it to be written to as the code runs."""
+    return Runner.context(
+        policy or load_policy(restricted=restricted),
+        RunnerInputBuffer(user_input),
+        RunnerOutputBuffer(output),
+    ).build(code, mode)
+
 
 if __name__ == "__main__":
     code = """1"""
-    run = Runner.context(
-        RunnerConfig(pathlib.Path(__file__).parent.parent / "config")
-    ).build(code, "eval")
+    run = build_runner(code, "eval")
     run.run()
     if run.output:
         out = run.output.rstrip().replace("\n", "\n>>> ")
@@ -103,9 +155,7 @@ if __name__ == "__main__":
 import types
 os.__getattr__ = types.MethodType(lambda self, name: super().__getattribute__(name), os)
 print(os.__str__())"""
-    run = Runner.context(
-        RunnerConfig(pathlib.Path(__file__).parent.parent / "config")
-    ).build(code, "exec")
+    run = build_runner(code, "exec")
     run.run()
     if run.output:
         out = run.output.rstrip().replace("\n", "\n>>> ")
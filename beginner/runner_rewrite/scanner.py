@@ -1,29 +1,92 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import AbstractSet, FrozenSet, Set
 import ast
-from typing import Set
-
-
-class Scanner:
-    def __init__(self, ast_object: ast.AST):
-        self._ast = ast_object
-
-    def get_imports(self) -> Set[str]:
-        modules = set()
-        for node in ast.walk(self._ast):
-            if isinstance(node, ast.Import):
-                modules.add(node.names[0].name)
-            elif isinstance(node, ast.ImportFrom):
-                modules.add(node.module)
-            elif (
-                isinstance(node, ast.Call)
-                and hasattr(node.func, "id")
-                and node.func.id == "__import__"
-            ):
-                modules.add(node.args[0].n)
-        return modules
-
-    def get_dunder_attributes(self) -> Set[str]:
-        attributes = set()
-        for node in ast.walk(self._ast):
-            if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
-                attributes.add(node.attr)
-        return attributes
+import functools
+
+
+ATTRIBUTE_FUNCTIONS = frozenset({"getattr", "setattr", "delattr", "hasattr"})
+
+
+@dataclass(frozen=True)
+class ScanResult:
+    """Everything the runners check before running code.
+
+    dunder_names are dunder names used directly (__builtins__, __loader__, etc.) and attribute_strings are dunder
+    names passed as constants to getattr & friends, both are ways around the dunder attribute check."""
+
+    dunder_attributes: FrozenSet[str]
+    dunder_names: FrozenSet[str]
+    attribute_strings: FrozenSet[str]
+    imports: FrozenSet[str]
+
+    def disabled(
+        self, allowed_names: AbstractSet[str], allowed_attributes: AbstractSet[str]
+    ) -> FrozenSet[str]:
+        """Names & attributes are checked against their own allow lists, a builtin like __import__ being usable as a
+        name doesn't make it safe to look up as an attribute."""
+        return (self.dunder_names - allowed_names) | (
+            (self.dunder_attributes | self.attribute_strings) - allowed_attributes
+        )
+
+
+class Scanner(ast.NodeVisitor):
+    """Collects the dunder attributes, dunder names, imports & __import__ calls in a single walk of the tree."""
+
+    def __init__(self):
+        self._dunder_attributes: Set[str] = set()
+        self._dunder_names: Set[str] = set()
+        self._attribute_strings: Set[str] = set()
+        self._imports: Set[str] = set()
+
+    @classmethod
+    def scan_tree(cls, tree: ast.AST) -> ScanResult:
+        scanner = cls()
+        scanner.visit(tree)
+        return ScanResult(
+            frozenset(scanner._dunder_attributes),
+            frozenset(scanner._dunder_names),
+            frozenset(scanner._attribute_strings),
+            frozenset(scanner._imports),
+        )
+
+    def visit_Attribute(self, node: ast.Attribute):
+        if node.attr.startswith("__"):
+            self._dunder_attributes.add(node.attr)
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        if node.id.startswith("__"):
+            self._dunder_names.add(node.id)
+
+    def visit_Import(self, node: ast.Import):
+        self._imports.update(alias.name for alias in node.names)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.module:
+            self._imports.add(node.module)
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Name):
+            if node.func.id == "__import__" and (name := _constant_string(node, 0)):
+                self._imports.add(name)
+            elif node.func.id in ATTRIBUTE_FUNCTIONS:
+                name = _constant_string(node, 1)
+                if name and name.startswith("__"):
+                    self._attribute_strings.add(name)
+        self.generic_visit(node)
+
+
+@functools.lru_cache(maxsize=256)
+def scan(source: str, mode: str = "exec", filename: str = "<string>") -> ScanResult:
+    """Parses & scans the source, results are cached by the source so code that is run over and over (eval in a
+    loop) is only checked once. Raises SyntaxError if the source can't be parsed."""
+    return Scanner.scan_tree(ast.parse(source, filename, mode))
+
+
+def _constant_string(node: ast.Call, index: int) -> str:
+    if len(node.args) > index and isinstance(node.args[index], ast.Constant):
+        value = node.args[index].value
+        if isinstance(value, str):
+            return value
+    return ""
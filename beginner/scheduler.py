@@ -1,21 +1,37 @@
 from __future__ import annotations
+from beginner.config import scope_getter
 from beginner.exceptions import BeginnerException
 from beginner.logging import get_logger
+from beginner.models import chunked, fn
 from beginner.models.scheduler import Scheduler
+from beginner.serialization import DecodingError, dumps, loads, loads_pickle
 from beginner.tags import build_tag_set, fetch_tags
 from datetime import datetime, timedelta
-from typing import Any, AnyStr, Callable, Dict, Set, Union
+from collections import Counter
+from dataclasses import dataclass
+from typing import AnyStr, Callable, Dict, List, Optional, Set, Tuple, Union
 import asyncio
-import pickle
+import contextlib
+import heapq
 
 
 logger = get_logger(("beginner.py", "scheduler"))
+PAYLOAD_VERSION = 1  # Changed when the layout of payloads changes
+BATCH_SIZE = 500  # Most tasks fetched & deleted by one query
+RETRY_DELAY = 60  # Seconds to wait after the database fails
+WINDOW = timedelta(hours=1)  # How far ahead tasks are loaded
+
+_dispatcher: Optional[TaskDispatcher] = None
+_misfire_policies: Dict[str, MisfirePolicy] = {}
 
 
 def initialize_scheduler(loop=asyncio.get_event_loop()):
-    """Loads scheduler tasks from the database and schedules them to run."""
-    for task in Scheduler.select():
-        loop.create_task(_schedule(task, pickle.loads(task.payload.encode())))
+    """Starts the dispatcher that runs the tasks saved in the database. Does nothing if it's already running, so
+    it's safe to call every time the bot reconnects."""
+    global _dispatcher
+    if not _dispatcher or _dispatcher.closed:
+        _dispatcher = TaskDispatcher(loop)
+        _dispatcher.start()
 
 
 def schedule(
@@ -41,42 +57,33 @@ def schedule(
         else when.replace(tzinfo=datetime.utcnow().tzinfo)
     )
     time = _seconds_until_run(when)
-    payload = {"args": args, "kwargs": kwargs}
     if time <= 0:
         raise TaskScheduledForPast(
             f"Task {name} was scheduled for {when} which was {time} seconds ago ({datetime.now()})"
         )
-    task = _schedule_save(name, when, tags, pickle.dumps(payload, 0).decode())
-    loop.create_task(_schedule(task, payload))
+    payload = dumps({"v": PAYLOAD_VERSION, "args": list(args), "kwargs": kwargs})
+    task = _schedule_save(name, when, tags, payload)
+    if _dispatcher:
+        _dispatcher.add(task)
     return True
 
 
 def task_scheduled(name):
+    if _dispatcher and _dispatcher.names_loaded:
+        return _dispatcher.scheduled(name)
     return _count_scheduled(name) > 0
 
 
-async def _schedule(task: Scheduler, payload: Dict):
-    """Schedules a task and calls the"""
-    time = _seconds_until_run(task.when.replace(tzinfo=datetime.utcnow().tzinfo))
-    logger.debug(f"Scheduling {task.name} for {task.when} {task.when.tzinfo} - {time}")
-    if time > 0:
-        await asyncio.sleep(time)
-    logger.debug(f"Triggering {task.name} running callbacks tagged {task.tag}")
-    logger.debug(f"- SCHEDULED FOR: {task.when}")
-    logger.debug(f"- RUNNING AT:    {datetime.now()}")
-    await _trigger_task(task, payload)
-
-
 def _count_scheduled(name: AnyStr) -> int:
     return Scheduler.select().where(Scheduler.name == name).count()
 
 
 def _schedule_save(
-    name: AnyStr, when: datetime, tags: Set, payload: AnyStr
+    name: AnyStr, when: datetime, tags: Set, payload: bytes
 ) -> Scheduler:
     """Takes task parameters and creates a Scheduler row in the database."""
     tag = ",".join(map(str, tags))  # Convert the tag set to a string
-    task = Scheduler(name=name, when=when, tag=tag, payload=payload)
+    task = Scheduler(name=name, when=when, tag=tag, data=payload)
     task.save()
     logger.debug(f"Saved {task.name} for {task.when}")
     return task
@@ -86,13 +93,33 @@ def _seconds_until_run(when: datetime) -> float:
     return (when - datetime.now()).total_seconds()
 
 
-async def _trigger_task(task: Scheduler, payload: Any):
-    """Runs the callbacks tagged for this task and removes the task from the database."""
+async def _trigger_task(task: Scheduler):
+    """Runs the callbacks tagged for this task."""
+    logger.debug(f"Triggering {task.name} running callbacks tagged {task.tag}")
+    logger.debug(f"- SCHEDULED FOR: {task.when}")
+    logger.debug(f"- RUNNING AT:    {datetime.now()}")
+    try:
+        payload = _load_payload(task)
+    except DecodingError:
+        logger.exception(f"Could not load the payload for {task.name}, skipping it")
+        return
+
     tags = set(task.tag.split(","))
-    name = task.name
-    task.delete_instance()
     ran = await _run_tags(tags, payload)
-    logger.debug(f"Attempted to run {ran} callback{'s' if ran > 1 else ''} for {name}")
+    logger.debug(
+        f"Attempted to run {ran} callback{'s' if ran > 1 else ''} for {task.name}"
+    )
+
+
+def _load_payload(task: Scheduler) -> Dict:
+    """Decodes the task's payload, rows saved before payloads were encoded still have a pickle."""
+    if task.data is None:
+        return loads_pickle(task.payload)
+
+    payload = loads(bytes(task.data))
+    if not isinstance(payload, dict) or payload.get("v") != PAYLOAD_VERSION:
+        raise DecodingError(f"Unsupported payload version: {payload!r:.64}")
+    return {"args": tuple(payload["args"]), "kwargs": payload["kwargs"]}
 
 
 async def _run_tags(tags: Set, payload: Dict):
@@ -108,6 +135,214 @@ async def _run_tags(tags: Set, payload: Dict):
         return len(callbacks)
 
 
+@dataclass(frozen=True)
+class MisfirePolicy:
+    """How tasks that fire late, usually because the bot was offline, are handled. Coalesced tasks only run the
+    latest of the late tasks with the same name, tags & payload. Tasks that are later than max_age are skipped."""
+
+    coalesce: bool = False
+    max_age: Optional[timedelta] = None
+
+
+DEFAULT_MISFIRE_POLICY = MisfirePolicy()
+
+
+def misfire_policy(*, coalesce: bool = False, max_age: Optional[timedelta] = None):
+    """Decorator that sets the misfire policy for a callback's schedule tags, it has to be applied above @tag."""
+    policy = MisfirePolicy(coalesce, max_age)
+
+    def decorator(callback):
+        for name in build_tag_set(callback) - {"schedule"}:
+            _misfire_policies[name] = policy
+        return callback
+
+    return decorator
+
+
+def _get_misfire_policy(tag: str) -> MisfirePolicy:
+    for name in tag.split(","):
+        if name in _misfire_policies:
+            return _misfire_policies[name]
+    return DEFAULT_MISFIRE_POLICY
+
+
+class TaskDispatcher:
+    """Runs scheduled tasks from a single asyncio task.
+
+    Only tasks due within the next WINDOW are loaded, they're kept in a heap of (when, ID) pairs & the dispatcher
+    sleeps until the earliest of them or the end of the window. Everything that is due when it wakes is fetched as
+    one batch, late tasks are filtered by their misfire policies & the rest are queued. Tasks scheduled further out
+    stay in the database until their window is loaded.
+
+    The queue is drained at no more than drain_rate tasks a second so a backlog, like the one left after a restart,
+    doesn't flood Discord. Started tasks are deleted in batches once the queue is empty.
+
+    The names of all saved tasks are counted so checking if a task is already scheduled doesn't need a query."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        settings = scope_getter("scheduler")
+        self._drain_rate = settings("drain_rate", default=5)
+        self._heap: List[Tuple[datetime, int]] = []
+        self._loaded_until: Optional[datetime] = None
+        self._loop = loop
+        self._misfire_grace = timedelta(seconds=settings("misfire_grace", default=60))
+        self._names: Optional[Counter] = None
+        self._queue: asyncio.Queue[Scheduler] = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return not self._tasks or any(task.done() for task in self._tasks)
+
+    @property
+    def names_loaded(self) -> bool:
+        return self._names is not None
+
+    def scheduled(self, name: str) -> bool:
+        return self._names[name] > 0
+
+    def start(self):
+        self._tasks = [
+            self._loop.create_task(self._dispatch()),
+            self._loop.create_task(self._drain()),
+        ]
+
+    def add(self, task: Scheduler):
+        """Adds a task that was just saved, it's left for a later window if it isn't due in the loaded one."""
+        if self.names_loaded:
+            self._names[task.name] += 1
+
+        if self._loaded_until and task.when < self._loaded_until:
+            heapq.heappush(self._heap, (task.when, task.ID))
+            if self._heap[0][1] == task.ID:
+                self._wake.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wake.clear()
+            try:
+                now = datetime.now()
+                if not self.names_loaded:
+                    self._load_names()
+                if not self._loaded_until or now >= self._loaded_until:
+                    self._load_window(now + WINDOW)
+                self._fire_due(now)
+            except Exception:
+                logger.exception("Failed to dispatch scheduled tasks")
+                delay = RETRY_DELAY
+            else:
+                wake_at = self._heap[0][0] if self._heap else self._loaded_until
+                delay = _seconds_until_run(min(wake_at, self._loaded_until))
+
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), max(delay, 0))
+
+    async def _drain(self):
+        started = []
+        while True:
+            if started and self._queue.empty():
+                started = self._delete(started)
+
+            task = await self._queue.get()
+            self._forget(task)
+            self._loop.create_task(_trigger_task(task))
+            started.append(task.ID)
+            if len(started) >= BATCH_SIZE:
+                started = self._delete(started)
+
+            if self._drain_rate:
+                await asyncio.sleep(1 / self._drain_rate)
+
+    def _load_names(self):
+        query = Scheduler.select(Scheduler.name, fn.COUNT(Scheduler.ID).alias("count"))
+        self._names = Counter(
+            {row.name: row.count for row in query.group_by(Scheduler.name)}
+        )
+
+    def _load_window(self, until: datetime):
+        query = Scheduler.select(Scheduler.ID, Scheduler.when).where(
+            Scheduler.when < until
+        )
+        if self._loaded_until:
+            query = query.where(Scheduler.when >= self._loaded_until)
+
+        for task in query:
+            heapq.heappush(self._heap, (task.when, task.ID))
+        self._loaded_until = until
+        logger.debug(f"Loaded scheduled tasks until {until}, {len(self._heap)} pending")
+
+    def _fire_due(self, now: datetime):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+
+        if not due:
+            return
+
+        tasks = []
+        try:
+            for batch in chunked([task_id for _, task_id in due], BATCH_SIZE):
+                tasks.extend(Scheduler.select().where(Scheduler.ID.in_(batch)))
+        except Exception:
+            for item in due:
+                heapq.heappush(self._heap, item)
+            raise
+
+        run, skipped = self._apply_misfire_policies(tasks, now)
+        for task in run:
+            self._queue.put_nowait(task)
+
+        for task in skipped:
+            self._forget(task)
+        self._delete([task.ID for task in skipped])
+
+    def _apply_misfire_policies(
+        self, tasks: List[Scheduler], now: datetime
+    ) -> Tuple[List[Scheduler], List[Scheduler]]:
+        """Splits the tasks into those that should run and those that should be skipped."""
+        run, skipped = [], []
+        coalesced: Dict[Tuple, Scheduler] = {}
+        for task in sorted(tasks, key=lambda task: task.when):
+            late = now - task.when
+            policy = _get_misfire_policy(task.tag)
+            if late <= self._misfire_grace:
+                run.append(task)
+            elif policy.max_age is not None and late > policy.max_age:
+                logger.info(f"Skipping {task.name}, it was due {late} ago")
+                skipped.append(task)
+            elif policy.coalesce:
+                key = (
+                    task.name,
+                    task.tag,
+                    task.payload,
+                    task.data and bytes(task.data),
+                )
+                if key in coalesced:
+                    skipped.append(coalesced[key])
+                coalesced[key] = task
+            else:
+                run.append(task)
+
+        return run + list(coalesced.values()), skipped
+
+    def _delete(self, ids: List[int]) -> List[int]:
+        """Deletes the tasks, returning the IDs that couldn't be deleted so they can be tried again."""
+        try:
+            with Scheduler._meta.database.atomic():
+                for batch in chunked(ids, BATCH_SIZE):
+                    Scheduler.delete().where(Scheduler.ID.in_(batch)).execute()
+        except Exception:
+            logger.exception("Failed to delete scheduled tasks")
+            return ids
+        return []
+
+    def _forget(self, task: Scheduler):
+        self._names[task.name] -= 1
+        if self._names[task.name] <= 0:
+            del self._names[task.name]
+
+
 class TaskScheduledForPast(BeginnerException):
     pass
 
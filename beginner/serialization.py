@@ -0,0 +1,142 @@
+"""Encoding for values saved in the database.
+
+Values are stored as compact JSON. Values JSON can't represent (tuples, sets, datetimes, bytes, complex numbers,
+etc.) are written as {"$t": type, "v": value} objects, and anything the format doesn't know is rejected when it's
+saved instead of failing when it's loaded. Rows saved before the format existed hold protocol 0 pickles,
+loads_pickle loads those with an unpickler that only allows the few classes they could have contained."""
+from beginner.exceptions import BeginnerException
+from datetime import date, datetime, timedelta
+from typing import Any, Dict
+import base64
+import codecs
+import io
+import json
+import pickle
+
+
+TAG = "$t"
+
+
+def dumps(value: Any) -> bytes:
+    """Encodes the value. Raises EncodingError if it contains a type that can't be saved."""
+    return json.dumps(_encode(value), separators=(",", ":")).encode()
+
+
+def loads(data: bytes) -> Any:
+    """Decodes a value saved by dumps. Raises DecodingError if it isn't valid."""
+    try:
+        value = json.loads(data)
+    except ValueError as exc:
+        raise DecodingError(f"Value is not valid JSON: {exc}") from exc
+
+    return _decode(value)
+
+
+def loads_pickle(text: str) -> Any:
+    """Loads a value saved as a protocol 0 pickle without running arbitrary code."""
+    try:
+        return _RestrictedUnpickler(io.BytesIO(text.encode())).load()
+    except (pickle.UnpicklingError, EOFError, ValueError) as exc:
+        raise DecodingError(f"Could not load pickled value: {exc}") from exc
+
+
+def _encode(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value) and TAG not in value:
+            return {key: _encode(item) for key, item in value.items()}
+        return _tagged("dict", [[_encode(k), _encode(v)] for k, v in value.items()])
+
+    if isinstance(value, tuple):
+        return _tagged("tuple", [_encode(item) for item in value])
+
+    if isinstance(value, (set, frozenset)):
+        return _tagged(type(value).__name__, [_encode(item) for item in value])
+
+    if isinstance(value, datetime):
+        return _tagged("datetime", value.isoformat())
+
+    if isinstance(value, date):
+        return _tagged("date", value.isoformat())
+
+    if isinstance(value, timedelta):
+        return _tagged("timedelta", [value.days, value.seconds, value.microseconds])
+
+    if isinstance(value, bytes):
+        return _tagged("bytes", base64.b64encode(value).decode())
+
+    if isinstance(value, complex):
+        return _tagged("complex", [value.real, value.imag])
+
+    raise EncodingError(f"Cannot save {type(value).__name__} values")
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    if TAG not in value:
+        return {key: _decode(item) for key, item in value.items()}
+
+    decoder = _DECODERS.get(value[TAG])
+    if not decoder:
+        raise DecodingError(f"Unknown value type: {value[TAG]!r:.64}")
+
+    try:
+        return decoder(value["v"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise DecodingError(f"Invalid {value[TAG]} value: {exc}") from exc
+
+
+def _tagged(type_name: str, value: Any) -> Dict[str, Any]:
+    return {TAG: type_name, "v": value}
+
+
+_DECODERS = {
+    "dict": lambda items: {_decode(k): _decode(v) for k, v in items},
+    "tuple": lambda items: tuple(map(_decode, items)),
+    "set": lambda items: set(map(_decode, items)),
+    "frozenset": lambda items: frozenset(map(_decode, items)),
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "timedelta": lambda parts: timedelta(*parts),
+    "bytes": lambda data: base64.b64decode(data, validate=True),
+    "complex": lambda parts: complex(*parts),
+}
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    allowed = {
+        ("_codecs", "encode"): codecs.encode,  # How protocol 0 saves bytes
+        ("datetime", "date"): date,
+        ("datetime", "datetime"): datetime,
+        ("datetime", "timedelta"): timedelta,
+        **{
+            (module, cls.__name__): cls
+            for module in ("__builtin__", "builtins")  # Python 2 names are kept for protocol 0
+            for cls in (complex, frozenset, set)
+        },
+    }
+
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) not in self.allowed:
+            raise pickle.UnpicklingError(
+                f"{module}.{name} is not allowed in a saved value"
+            )
+        return self.allowed[module, name]
+
+
+class EncodingError(BeginnerException):
+    pass
+
+
+class DecodingError(BeginnerException):
+    pass
@@ -1,6 +1,13 @@
+from beginner.exceptions import BeginnerException
 from beginner.models.settings import Settings as SettingsModel
-from typing import Any, AnyStr, Optional
-import pickle
+from typing import Any, AnyStr, Dict, Optional
+import beginner.serialization as serialization
+import time
+import uuid
+
+
+VERSION_CHECK_INTERVAL = 5  # Seconds between checks for changes made by other processes
+VERSION_NAME = "__settings_version__"  # Row changed on every write so other processes know to reload
 
 
 class NOT_SET_TYPE:
@@ -18,42 +25,84 @@ class NOT_SET_TYPE:
 
 
 class Settings:
+    """Settings are read from an in-process cache of every row that's shared by all instances. Writes upsert the
+    value & a new version token in one statement and update the cache. The cache is reloaded when another process has changed
+    the version, which is checked at most every VERSION_CHECK_INTERVAL seconds."""
+
     NOT_SET = NOT_SET_TYPE()
     ERROR = NOT_SET_TYPE("ERROR")
 
+    _cache: Optional[Dict[str, Any]] = None
+    _checked_at = 0.0
+    _version: Any = None
+
     def _get(self, name: AnyStr) -> Any:
-        result = SettingsModel.select(SettingsModel.value).where(
-            SettingsModel.name == name
-        )
-        value = Settings.NOT_SET
-        if result.count():
-            try:
-                value = pickle.loads(result.scalar().encode())
-            except pickle.UnpicklingError:
-                return Settings.ERROR
-
-        return value
+        return self._load().get(name, Settings.NOT_SET)
 
     def _set(self, name: AnyStr, value: Any):
-        pickled = pickle.dumps(value, 0)
-        if self._get(name) is Settings.NOT_SET:
-            SettingsModel(name=name, value=pickled).save()
-        else:
-            SettingsModel.update(value=pickled).where(
-                SettingsModel.name == name
-            ).execute()
+        """Saves the value & a new version in a single upsert."""
+        if name == VERSION_NAME:
+            raise ReservedSettingName(f"{VERSION_NAME} is reserved for the settings cache")
+
+        cache = self._load()
+        version = uuid.uuid4().hex.encode()
+        SettingsModel.insert_many(
+            [
+                {"name": name, "data": serialization.dumps(value)},
+                {"name": VERSION_NAME, "data": version},
+            ]
+        ).on_conflict(
+            conflict_target=[SettingsModel.name], preserve=[SettingsModel.data]
+        ).execute()
+        cache[name] = value
+        Settings._version = version
+
+    def _load(self) -> Dict[str, Any]:
+        """Gets the cache, loading every row if it's empty or another process has written since it was loaded."""
+        now = time.monotonic()
+        if (
+            Settings._cache is not None
+            and now - Settings._checked_at < VERSION_CHECK_INTERVAL
+        ):
+            return Settings._cache
+
+        if Settings._cache is not None:
+            version = (
+                SettingsModel.select(SettingsModel.data)
+                .where(SettingsModel.name == VERSION_NAME)
+                .scalar()
+            )
+            if _bytes(version) == Settings._version:
+                Settings._checked_at = now
+                return Settings._cache
+
+        rows = {
+            name: (value, data)
+            for name, value, data in SettingsModel.select(
+                SettingsModel.name, SettingsModel.value, SettingsModel.data
+            ).tuples()
+        }
+        Settings._version = _bytes(rows.pop(VERSION_NAME, (None, None))[1])
+        Settings._cache = {
+            name: self._decode(value, data) for name, (value, data) in rows.items()
+        }
+        Settings._checked_at = now
+        return Settings._cache
 
     def all(self):
         return {
-            row.name: self._load_pickle(row.value)
-            for row in SettingsModel.select().distinct()
+            name: "FAILED TO LOAD" if value is Settings.ERROR else value
+            for name, value in self._load().items()
         }
 
-    def _load_pickle(self, data):
+    def _decode(self, value: str, data: Optional[bytes]) -> Any:
+        """Decodes a row's value, rows that haven't been written since values were encoded still have a pickle."""
         try:
-            return pickle.loads(data.encode())
-        except pickle.UnpicklingError:
-            return "FAILED TO UNPICKLE"
+            if data is None:
+                return serialization.loads_pickle(value)
+            return serialization.loads(bytes(data))
+        except serialization.DecodingError:
+            return Settings.ERROR
 
     def get(self, name: AnyStr, default: Optional[Any] = None) -> Any:
         return default if (value := self._get(name)) is Settings.NOT_SET else value
@@ -63,3 +112,11 @@ class Settings:
 
     def __setitem__(self, key: AnyStr, value: Any):
         self._set(key, value)
+
+
+def _bytes(data: Optional[bytes]) -> Optional[bytes]:
+    return None if data is None else bytes(data)
+
+
+class ReservedSettingName(BeginnerException):
+    pass
@@ -0,0 +1,78 @@
+from beginner import kudos
+from beginner.models import SqliteDatabase, set_database
+from beginner.models.points import KudosPools, KudosTotals, Points
+from datetime import datetime, timedelta
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def db():
+    db = SqliteDatabase(":memory:")
+    set_database(db)
+    kudos._pools.clear()
+    Points.create(
+        awarded=datetime.utcnow(),
+        user_id=1,
+        giver_id=2,
+        message_id=10,
+        points=4,
+        point_type="KUDOS",
+    )
+    kudos.backfill_kudos_totals()
+    yield db
+    db.close()
+
+
+def count_queries(db, monkeypatch):
+    queries = []
+    execute_sql = db.execute_sql
+
+    def counted(sql, *args, **kwargs):
+        queries.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute_sql", counted)
+    return queries
+
+
+def test_givers_are_only_loaded_once(db, monkeypatch):
+    async def react():
+        queue = kudos.KudosQueue()
+        queries = count_queries(db, monkeypatch)
+        assert queue.give(10, 2, 1, 8) == 4
+        assert queue.give(11, 2, 1, 2) == 0
+        assert queue.give(10, 2, 1, 2) == 8
+        assert queue.remove(11, 2) == 2
+        assert queue.remove(11, 2) == 0
+        assert len(queries) == 1
+        queue.flush()
+
+    asyncio.run(react())
+    assert kudos.get_kudos_given(2) == {10: 2}
+    assert KudosTotals.get(KudosTotals.user_id == 1).total == 2
+
+
+def test_pool_points_are_only_spent_once(db):
+    now = datetime(2026, 1, 1, 12)
+    kudos.create_kudos_pool(2, 8, now)
+    assert kudos.spend_kudos_pool(2, 8, 8, 12, now)
+    assert not kudos.spend_kudos_pool(2, 8, 8, 12, now)
+    assert KudosPools.get_by_id(2).points == 0
+
+
+def test_pools_changed_elsewhere_are_reloaded(db):
+    now = datetime(2026, 1, 1, 12)
+    kudos.create_kudos_pool(2, 8, now)
+    KudosPools.update(points=2).where(KudosPools.giver_id == 2).execute()
+    assert not kudos.spend_kudos_pool(2, 4, 8, 12, now)
+    assert kudos.spend_kudos_pool(2, 2, 8, 12, now)
+    assert kudos.get_kudos_pool(2) == (0, now)
+
+
+def test_pools_regenerate_and_refunds_are_capped(db):
+    now = datetime(2026, 1, 1, 12)
+    kudos.create_kudos_pool(2, 0, now)
+    assert kudos.spend_kudos_pool(2, 2, 8, 12, now + timedelta(minutes=24))
+    assert kudos.spend_kudos_pool(2, -20, 8, 12, now + timedelta(minutes=24))
+    assert KudosPools.get_by_id(2).points == 8
@@ -0,0 +1,52 @@
+from beginner.runner_rewrite.runner import build_runner
+import pytest
+
+
+def run(code):
+    runner = build_runner(code, "exec")
+    runner.run()
+    return runner
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import math\nprint(math.policy)",
+        "import math\nprint(math.__policy__)",
+        "import math\nprint(getattr(math, '__policy__'))",
+    ],
+)
+def test_policy_is_hidden_from_sandboxed_code(code):
+    runner = run(code)
+    assert "RunnerPolicy" not in runner.output
+    assert runner.exception
+
+
+def test_vars_only_shows_module_attributes():
+    runner = run("import math\nmath.sqrt(4)\nprint(sorted(vars(math)))")
+    assert runner.output == "['sqrt']\n"
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import pickle\npickle.dumps(1)\nprint(pickle._PickleWrapper__pickles)",
+        "import pickle\nprint(getattr(pickle, '_PickleWrapper__pickles'))",
+        "import pickle\npickle._PickleWrapper__pickles = {}",
+        "import math\nprint(math._ModuleWrapper__enabled_attribute)",
+    ],
+)
+def test_name_mangled_attributes_are_blocked(code):
+    runner = run(code)
+    assert runner.output == ""
+    assert "disabled for security reasons" in runner.exception
+
+
+def test_pickle_round_trips_through_tokens():
+    runner = run("import pickle\nprint(pickle.loads(pickle.dumps([1, 2])))")
+    assert runner.output == "[1, 2]\n"
+
+
+def test_wrapper_methods_dont_shadow_module_attributes():
+    runner = run("import textwrap\nprint(textwrap.wrap('a b', 1))")
+    assert runner.output == "['a', 'b']\n"
@@ -0,0 +1,55 @@
+from beginner.runner_cache import RunnerCache, is_deterministic
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import calendar; print(calendar.datetime.datetime.now())",
+        "import _strptime; print(_strptime.time.time())",
+        "from calendar import datetime\nprint(datetime.datetime.now())",
+        "import statistics\nprint(statistics.random.random())",
+        "import unittest",
+        "import timeit\nprint(timeit.timeit('1'))",
+        "import uuid\nprint(uuid.uuid4())",
+        "import calendar\nprint(getattr(calendar, 'datetime'))",
+        "print(__import__('time').time())",
+        "from . import x",
+        "import numpy as np; np.random.rand()",
+        "from numpy import random",
+        "import numpy.random",
+        "print(object())",
+        'print({"a", "b"})',
+        "print(set('ab'))",
+        "print(id(1), hash('a'))",
+    ],
+)
+def test_nondeterministic_code_is_not_cached(code):
+    assert not is_deterministic(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "print(1 + 1)",
+        "import math\nprint(math.sqrt(2))",
+        "import calendar\nprint(calendar.month(2020, 1))",
+        "from collections import Counter\nprint(Counter('aab'))",
+        "import urllib.parse\nprint(urllib.parse.quote('a b'))",
+        "x = {'a': 1}\nprint(sorted(x))",
+        "def f(:",
+    ],
+)
+def test_deterministic_code_is_cached(code):
+    assert is_deterministic(code)
+
+
+def test_eval_mode():
+    assert is_deterministic("[1, 2][0]", "eval")
+    assert not is_deterministic("__import__('random').random()", "eval")
+
+
+def test_results_showing_addresses_are_not_cached():
+    assert not RunnerCache.cacheable_result("<object object at 0x7f0012ab>", "")
+    assert not RunnerCache.cacheable_result("", "Beginnerpy.ScriptTimedOut: Script")
+    assert RunnerCache.cacheable_result("1\n", "")
@@ -0,0 +1,53 @@
+from beginner.bytecode_cache import scan_and_compile
+from beginner.runner_rewrite.policy import load_policy
+from beginner.runner_rewrite.scanner import scan
+import pathlib
+import pytest
+import subprocess
+import sys
+
+
+ROOT = pathlib.Path(__file__).parent.parent
+BLOCKED = [
+    "x.__import__('os')",
+    "x.__build_class__",
+    "getattr(x, '__import__')",
+    "getattr(x, '__build_class__')",
+]
+
+
+@pytest.mark.parametrize("code", BLOCKED)
+def test_rewrite_policy_blocks_builtin_dunders_as_attributes(code):
+    policy = load_policy()
+    assert scan(code).disabled(
+        policy.allowed_dunder_names, policy.special_attributes
+    )
+
+
+def test_rewrite_policy_allows_builtin_dunders_as_names():
+    policy = load_policy()
+    assert not scan("__build_class__\nx.__name__").disabled(
+        policy.allowed_dunder_names, policy.special_attributes
+    )
+
+
+def test_legacy_executer_blocks_builtin_dunders_as_attributes():
+    # The legacy runner replaces os.environ when it's imported so it's checked in a separate process
+    script = f"""
+from beginner.runner import create_executer, load_allowed_modules
+from beginner.runner_rewrite.scanner import scan
+executer = create_executer(load_allowed_modules())
+for code in {BLOCKED!r}:
+    assert scan(code).disabled(executer.allowed_dunder_names, executer.allowed_dunder_attributes), code
+assert not scan("__import__('math')\\nx.__class__").disabled(
+    executer.allowed_dunder_names, executer.allowed_dunder_attributes
+)
+"""
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+
+
+def test_scan_and_compile_uses_one_parse():
+    scan_result, code = scan_and_compile("import math\nprint(math.pi)", "exec")
+    assert scan_result == scan("import math\nprint(math.pi)")
+    assert scan_and_compile("import math\nprint(math.pi)", "exec")[1] is code
+    assert "math" in scan_result.imports
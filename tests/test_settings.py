@@ -0,0 +1,41 @@
+from beginner.models import SqliteDatabase, set_database
+from beginner.models.settings import Settings as SettingsModel
+from beginner.settings import ReservedSettingName, Settings, VERSION_NAME
+import pytest
+
+
+@pytest.fixture
+def db():
+    db = SqliteDatabase(":memory:")
+    db.execute_sql(
+        "CREATE TABLE settings (id INTEGER PRIMARY KEY, name VARCHAR(256) NOT NULL, value VARCHAR(2048) NOT NULL)"
+    )
+    db.execute_sql(
+        "INSERT INTO settings (name, value) VALUES ('a', 'I1\n.'), ('b', 'I2\n.'), ('a', 'I3\n.')"
+    )
+    set_database(db)
+    Settings._cache = None
+    yield db
+    db.close()
+
+
+def test_duplicates_are_removed_before_the_unique_index_is_added(db):
+    rows = list(SettingsModel.select(SettingsModel.name, SettingsModel.value).tuples())
+    assert sorted(rows) == [("a", "I3\n."), ("b", "I2\n.")]
+    assert any(index.unique for index in db.get_indexes("settings"))
+
+
+def test_values_are_upserted(db):
+    settings = Settings()
+    assert settings["a"] == 3
+    settings["a"] = {1, 2}
+    settings["c"] = 1 + 2j
+    Settings._cache = None
+    assert settings["a"] == {1, 2}
+    assert settings["c"] == 1 + 2j
+    assert SettingsModel.select().where(SettingsModel.name == "a").count() == 1
+
+
+def test_version_name_is_reserved(db):
+    with pytest.raises(ReservedSettingName):
+        Settings()[VERSION_NAME] = "x"